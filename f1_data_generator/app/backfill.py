@@ -0,0 +1,273 @@
+"""
+Faster-than-real-time backfill: generates a whole session's time series for a set of
+drivers in bulk and writes it with backdated `dateObserved`, without going through the
+live scheduler.
+
+    python -m app.backfill --drivers NOR,VER --rate 4 --output crate
+    python -m app.backfill --drivers ALL --rate 10 --output file --path monza.ndjson
+    python -m app.backfill --year 2023 --gp Monza --session R --drivers NOR --output orion
+
+Entities carry the live SESSION_KEY when the generator's own session is backfilled, and a
+key derived from the session otherwise, so historical races never share entities with
+each other or with the live cars; --session-key overrides it.
+
+Outputs:
+  file   NDJSON, one NGSI-v2 entity per line.
+  orion  Batched /v2/op/update requests. Orion only keeps the latest state per entity, so
+         the history reaches CrateDB only as far as the QuantumLeap subscription's
+         throttling lets the notifications through.
+  crate  Bulk INSERTs straight into QuantumLeap's doc.etcar table (the complete series),
+         then rebuilds the etcar rollup tiers over the backfilled range. Raw retention
+         is held off until the rollups are rebuilt.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import socket
+import sys
+import time
+import zlib
+from typing import Dict, Any, Iterator, List, Optional
+
+import numpy as np
+
+from app import main as service
+from app.cratedb import ETCAR_TABLE, ensure_etcar_table, execute_sql
+from app.rollups import ensure_rollup_tables, refresh_rollups, hold_raw_retention, release_raw_retention
+from app.shared_store import read_published_version, load_session_store
+from app.telemetry_store import SessionTelemetryStore, SAMPLE_STATUS_AFTER_FINISH, build_session_store
+
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_OUTPUTS = ("file", "orion", "crate")
+
+CRATE_INSERT_COLUMNS = [
+    "entity_id", "entity_type", "time_index", "fiware_servicepath", "speed", "rpm", "gear", "throttle",
+    "brake", "drs", "distance", "drivercode", "lapnumber", "timewithinlap", "simulatedelapsedtime",
+    "simulationsessionkey", "x", "y", "dateobserved",
+]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate a whole session's car time series in bulk.")
+    parser.add_argument("--year", type=int, default=service.GENERATOR_YEAR)
+    parser.add_argument("--gp", default=service.GENERATOR_GP)
+    parser.add_argument("--session", default=service.GENERATOR_SESSION)
+    parser.add_argument("--drivers", default=",".join(service.ACTIVE_DRIVER_CODES), help="Comma-separated driver codes, or ALL")
+    parser.add_argument("--rate", type=float, default=1.0, help="Samples per second of race time")
+    parser.add_argument("--start", type=float, default=0.0, help="First simulated second to generate")
+    parser.add_argument("--end", type=float, default=None, help="Last simulated second to generate (default: each driver's finish)")
+    parser.add_argument("--session-key", type=int, default=None, help="simulationSessionKey of the written entities (default: SESSION_KEY for the generator session, otherwise derived from the session)")
+    parser.add_argument("--observed-start", default=None, help="ISO-8601 dateObserved of t=0 (default: the historical session time when known)")
+    parser.add_argument("--output", choices=BACKFILL_OUTPUTS, default="file")
+    parser.add_argument("--path", default=None, help="Output file for --output file (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Entities per Orion update / rows per CrateDB bulk insert")
+    args = parser.parse_args(argv)
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+    return args
+
+
+def load_store(year: int, gp: str, session_identifier: str, driver_codes: Optional[List[str]]) -> SessionTelemetryStore:
+    """Maps the worker's published store when it covers the session, otherwise builds one from FastF1."""
+    is_generator_session = (year, gp, session_identifier) == (service.GENERATOR_YEAR, service.GENERATOR_GP, service.GENERATOR_SESSION)
+    if is_generator_session and service.SHARED_STORE_DIRECTORY:
+        version = read_published_version(service.SHARED_STORE_DIRECTORY)
+        if version is not None:
+            logger.info(f"Using published telemetry store version {version} from {service.SHARED_STORE_DIRECTORY}")
+            store, _ = load_session_store(service.SHARED_STORE_DIRECTORY, version)
+            return store
+
+    logger.info(f"Loading session {year} {gp} {session_identifier} from FastF1...")
+    fastf1 = service.get_fastf1()
+    f1_session = fastf1.get_session(year, gp, session_identifier)
+    f1_session.load(laps=True, telemetry=True, weather=False, messages=False)
+    return build_session_store(f1_session, year, session_identifier, driver_codes)
+
+
+def derive_session_key(year: int, event_name: str, session_identifier: str) -> int:
+    """
+    Stable key for a backfilled session: the year followed by four digits hashed from the
+    event and session, so each historical race gets its own entities, e.g. 20231587.
+    """
+    digest = zlib.crc32(f"{event_name}|{session_identifier}".lower().encode()) % 10000
+    return year * 10000 + digest
+
+
+def generate_driver_series(
+    store: SessionTelemetryStore,
+    driver_code: str,
+    rate_hz: float,
+    t_start: float,
+    t_end: Optional[float],
+    observed_origin_epoch: Optional[float]
+) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Samples one driver over [t_start, t_end] at `rate_hz` in a single vectorized pass and
+    adds the unix epoch each sample is observed at. Samples past the driver's finish are dropped.
+    """
+    driver_telemetry = store.get(driver_code)
+    if driver_telemetry is None:
+        logger.warning(f"No telemetry for driver '{driver_code}' in {store.year} {store.event_name} {store.session_identifier}. Skipping.")
+        return None
+
+    # Every car runs on the session clock whose t=0 is the race start, as in the live generator.
+    race_start_seconds = store.race_start_ms / 1000.0
+    race_duration = float(driver_telemetry.lap_end_ms[-1]) / 1000.0 - race_start_seconds
+    end = race_duration if t_end is None else min(t_end, race_duration)
+    if end < t_start:
+        return None
+
+    sample_count = int(np.floor((end - t_start) * rate_hz + 1e-9)) + 1
+    simulated_times = t_start + np.arange(sample_count, dtype=np.float64) / rate_hz
+    columns = store.sample(driver_code, simulated_times)
+    keep = columns["status"] != SAMPLE_STATUS_AFTER_FINISH
+    columns = {name: values[keep] for name, values in columns.items()}
+
+    if observed_origin_epoch is None:
+        observed_origin_epoch = store.session_t0_epoch + race_start_seconds
+    columns["observed_epoch"] = observed_origin_epoch + simulated_times[keep]
+    return columns
+
+
+def iter_ngsi_entities(store: SessionTelemetryStore, driver_code: str, columns: Dict[str, np.ndarray], session_key: int) -> Iterator[Dict[str, Any]]:
+    names = [name for name in columns if name not in ("status", "observed_epoch")]
+    for observed_epoch, *values in zip(columns["observed_epoch"].tolist(), *(columns[name].tolist() for name in names)):
+        telemetry_data = dict(zip(names, values))
+        telemetry_data.update(driver_code=driver_code, year=store.year, gp=store.event_name, session=store.session_identifier)
+        yield service.format_to_ngsi_v2(telemetry_data, datetime.datetime.fromtimestamp(observed_epoch, tz=datetime.timezone.utc), session_key)
+
+
+def _batched(items: Iterator[Any], batch_size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_crate_rows(driver_code: str, columns: Dict[str, np.ndarray], batch_size: int, session_key: int) -> int:
+    entity_id = f"urn:ngsi-v2:Car:{driver_code}:{session_key}"
+    observed_ms = np.round(columns["observed_epoch"] * 1000.0).astype(np.int64).tolist()
+    rows = zip(
+        observed_ms,
+        columns["speed"].tolist(),
+        columns["rpm"].tolist(),
+        columns["gear"].tolist(),
+        columns["throttle"].tolist(),
+        columns["brake"].astype(bool).tolist(),
+        columns["drs"].tolist(),
+        columns["distance"].tolist(),
+        columns["target_lap_number"].tolist(),
+        columns["calculated_time_within_lap_seconds"].tolist(),
+        columns["simulated_elapsed_race_time_seconds"].tolist(),
+        columns["x"].tolist(),
+        columns["y"].tolist(),
+    )
+    stmt = (
+        f"INSERT INTO {ETCAR_TABLE} ({', '.join(CRATE_INSERT_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in CRATE_INSERT_COLUMNS)})"
+    )
+    written = 0
+    for batch in _batched(rows, batch_size):
+        bulk_args = [
+            [entity_id, "Car", observed, "/", speed, rpm, gear, throttle, brake, drs, distance, driver_code,
+             lap_number, time_within_lap, simulated, session_key, x, y, observed]
+            for observed, speed, rpm, gear, throttle, brake, drs, distance, lap_number, time_within_lap, simulated, x, y in batch
+        ]
+        execute_sql(service.CRATE_URL, stmt, bulk_args=bulk_args)
+        written += len(bulk_args)
+    return written
+
+
+def run(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    started = time.perf_counter()
+
+    requested = [code.strip().upper() for code in args.drivers.split(",") if code.strip()]
+    driver_codes = None if requested == ["ALL"] else requested
+    observed_origin_epoch = None
+    if args.observed_start:
+        observed_start = datetime.datetime.fromisoformat(args.observed_start.replace("Z", "+00:00"))
+        if observed_start.tzinfo is None:
+            observed_start = observed_start.replace(tzinfo=datetime.timezone.utc)
+        observed_origin_epoch = observed_start.timestamp()
+
+    store = load_store(args.year, args.gp, args.session, driver_codes)
+    if driver_codes is None:
+        driver_codes = store.driver_codes
+    if observed_origin_epoch is None and store.session_t0_epoch is None:
+        observed_origin_epoch = time.time()
+        logger.warning("Historical session start unknown; observing t=0 at the current time. Use --observed-start to choose.")
+    session_key = args.session_key
+    if session_key is None:
+        is_generator_session = (args.year, args.gp, args.session) == (service.GENERATOR_YEAR, service.GENERATOR_GP, service.GENERATOR_SESSION)
+        session_key = service.SESSION_KEY if is_generator_session else derive_session_key(store.year, store.event_name, store.session_identifier)
+    logger.info(f"Backfilling {driver_codes} from {store.year} {store.event_name} {store.session_identifier} at {args.rate} Hz to {args.output} as session key {session_key}")
+
+    retention_holder = None
+    if args.output == "crate":
+        ensure_etcar_table(service.CRATE_URL)
+        ensure_rollup_tables(service.CRATE_URL)
+        # Backdated rows land below the rollup watermark; keep retention off until they are rolled up.
+        retention_holder = f"backfill-{socket.gethostname()}-{os.getpid()}"
+        hold_raw_retention(service.CRATE_URL, retention_holder)
+    output_file = None
+    if args.output == "file":
+        output_file = open(args.path, "w") if args.path else sys.stdout
+
+    total = 0
+    observed_range = None
+    try:
+        for driver_code in driver_codes:
+            driver_started = time.perf_counter()
+            columns = generate_driver_series(store, driver_code, args.rate, args.start, args.end, observed_origin_epoch)
+            if columns is None:
+                continue
+
+            if args.output == "crate":
+                hold_raw_retention(service.CRATE_URL, retention_holder)
+                written = write_crate_rows(driver_code, columns, args.batch_size, session_key)
+                if written:
+                    first, last = float(columns["observed_epoch"][0]), float(columns["observed_epoch"][-1])
+                    observed_range = (first, last) if observed_range is None else (min(observed_range[0], first), max(observed_range[1], last))
+            else:
+                written = 0
+                for batch in _batched(iter_ngsi_entities(store, driver_code, columns, session_key), args.batch_size):
+                    if args.output == "orion":
+                        service.send_to_orion(batch)
+                    else:
+                        output_file.write("".join(json.dumps(entity, separators=(",", ":")) + "\n" for entity in batch))
+                    written += len(batch)
+            total += written
+            logger.info(f"{driver_code}: {written} samples written in {time.perf_counter() - driver_started:.2f}s")
+
+        if args.output == "crate" and observed_range is not None:
+            execute_sql(service.CRATE_URL, f"REFRESH TABLE {ETCAR_TABLE}")
+            refresh_rollups(
+                service.CRATE_URL,
+                since=datetime.datetime.fromtimestamp(observed_range[0], tz=datetime.timezone.utc),
+                until=datetime.datetime.fromtimestamp(observed_range[1] + 1, tz=datetime.timezone.utc),
+                lap_lookback_seconds=service.ROLLUP_LAP_LOOKBACK_SECONDS
+            )
+    finally:
+        if output_file is not None and output_file is not sys.stdout:
+            output_file.close()
+        if retention_holder is not None:
+            release_raw_retention(service.CRATE_URL, retention_holder)
+
+    if args.output == "orion":
+        logger.info("Backdated entities reach etcar through QuantumLeap; once they have, run `python -m app.rollups --since ... --until ...` to roll them up.")
+
+    logger.info(f"Backfill finished: {total} samples for {len(driver_codes)} drivers in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
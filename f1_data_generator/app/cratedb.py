@@ -0,0 +1,65 @@
+import logging
+from typing import Dict, Any, List, Optional, Sequence
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+# QuantumLeap stores "Car" entities in doc.etcar, with lower-cased attribute names as columns.
+ETCAR_TABLE = '"doc"."etcar"'
+
+ETCAR_COLUMNS = {
+    "entity_id": "TEXT",
+    "entity_type": "TEXT",
+    "time_index": "TIMESTAMP WITH TIME ZONE",
+    "fiware_servicepath": "TEXT",
+    "speed": "REAL",
+    "rpm": "REAL",
+    "gear": "REAL",
+    "throttle": "REAL",
+    "brake": "BOOLEAN",
+    "drs": "BOOLEAN",
+    "distance": "REAL",
+    "drivercode": "TEXT",
+    "lapnumber": "REAL",
+    "timewithinlap": "REAL",
+    "simulatedelapsedtime": "REAL",
+    "simulationsessionkey": "REAL",
+    "x": "REAL",
+    "y": "REAL",
+    "dateobserved": "TIMESTAMP WITH TIME ZONE",
+}
+
+
+class CrateDBError(Exception):
+    pass
+
+
+def execute_sql(
+    crate_url: str,
+    stmt: str,
+    args: Optional[Sequence[Any]] = None,
+    bulk_args: Optional[List[Sequence[Any]]] = None,
+    timeout: float = 60
+) -> Dict[str, Any]:
+    """Runs one statement through CrateDB's HTTP `_sql` endpoint and returns the decoded response."""
+    payload: Dict[str, Any] = {"stmt": stmt}
+    if bulk_args is not None:
+        payload["bulk_args"] = bulk_args
+    elif args is not None:
+        payload["args"] = list(args)
+
+    try:
+        response = requests.post(f"{crate_url}/_sql", json=payload, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        raise CrateDBError(f"Could not reach CrateDB at {crate_url}: {e}") from e
+    if not response.ok:
+        raise CrateDBError(f"CrateDB rejected statement ({response.status_code}): {response.text}")
+    return response.json()
+
+
+def ensure_etcar_table(crate_url: str):
+    """Creates doc.etcar with QuantumLeap-compatible columns if QuantumLeap has not created it yet."""
+    columns = ", ".join(f'"{name}" {column_type}' for name, column_type in ETCAR_COLUMNS.items())
+    execute_sql(crate_url, f"CREATE TABLE IF NOT EXISTS {ETCAR_TABLE} ({columns})")
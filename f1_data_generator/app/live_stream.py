@@ -0,0 +1,167 @@
+import asyncio
+import collections
+import json
+import logging
+import struct
+import threading
+from typing import Dict, Any, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+FRAME_MAGIC = b"F1TK"
+# magic, car count, simulated elapsed race time (s), observation time (unix epoch s)
+FRAME_HEADER_STRUCT = struct.Struct("<4sHdd")
+# driverCode, lapNumber, timeWithinLap, distance, speed, x, y, rpm, throttle, gear, brake, drs,
+# racePosition (0 = unknown), gapToLeader, intervalToCarAhead (NaN = unknown),
+# sector, miniSector (0 = unknown), lapFraction (NaN = unknown)
+FRAME_CAR_STRUCT = struct.Struct("<3sHfffffHBb??BffBHf")
+
+STREAM_FORMATS = ("json", "binary")
+
+
+def _float_or_nan(value) -> float:
+    return float("nan") if value is None else value
+
+
+class StreamFrame:
+    """One tick of car states, encoded lazily and at most once per format for all clients."""
+
+    def __init__(self, simulated_elapsed_time: float, observed_at_epoch: float, date_observed: str, cars: List[Dict[str, Any]]):
+        self.simulated_elapsed_time = simulated_elapsed_time
+        self.observed_at_epoch = observed_at_epoch
+        self.date_observed = date_observed
+        self.cars = cars
+        self._json: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": "tick",
+            "simulatedElapsedTime": self.simulated_elapsed_time,
+            "dateObserved": self.date_observed,
+            "cars": self.cars
+        }
+
+    @property
+    def json_text(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), separators=(",", ":"))
+        return self._json
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            parts = [FRAME_HEADER_STRUCT.pack(FRAME_MAGIC, len(self.cars), self.simulated_elapsed_time, self.observed_at_epoch)]
+            for car in self.cars:
+                parts.append(FRAME_CAR_STRUCT.pack(
+                    car["driverCode"].encode("ascii")[:3],
+                    car["lapNumber"],
+                    car["timeWithinLap"],
+                    car["distance"],
+                    car["speed"],
+                    car["x"],
+                    car["y"],
+                    car["rpm"],
+                    car["throttle"],
+                    car["gear"],
+                    bool(car["brake"]),
+                    bool(car["drs"]),
+                    car.get("racePosition") or 0,
+                    _float_or_nan(car.get("gapToLeader")),
+                    _float_or_nan(car.get("intervalToCarAhead")),
+                    car.get("sector") or 0,
+                    car.get("miniSector") or 0,
+                    _float_or_nan(car.get("lapFraction"))
+                ))
+            self._binary = b"".join(parts)
+        return self._binary
+
+    def encode(self, stream_format: str):
+        return self.binary if stream_format == "binary" else self.json_text
+
+
+class StreamClient:
+    """A connected consumer with a bounded buffer; the oldest frame is dropped when it falls behind."""
+
+    def __init__(self, buffer_size: int):
+        self.frames = collections.deque(maxlen=buffer_size)
+        self.ready = asyncio.Event()
+        self.dropped_frames = 0
+
+    def push(self, frame: StreamFrame):
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped_frames += 1
+        self.frames.append(frame)
+        self.ready.set()
+
+    async def next_frame(self, timeout: Optional[float] = None) -> Optional[StreamFrame]:
+        """Waits for the next buffered frame; returns None if `timeout` elapses first."""
+        while not self.frames:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.frames.popleft()
+
+
+class TickBroadcaster:
+    """
+    Fans out generator ticks to WebSocket/SSE clients.
+
+    `publish` may be called from scheduler threads; delivery is handed over to the
+    event loop the clients live on, so client buffers are only touched from that loop.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self._clients: List[StreamClient] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self.published_frames = 0
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def register(self) -> StreamClient:
+        client = StreamClient(self.buffer_size)
+        with self._lock:
+            self._clients.append(client)
+        logger.info(f"Live stream client connected ({self.client_count} active).")
+        return client
+
+    def unregister(self, client: StreamClient):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        logger.info(f"Live stream client disconnected after dropping {client.dropped_frames} frames ({self.client_count} active).")
+
+    def publish(self, frame: StreamFrame):
+        if self._loop is None or not self._clients:
+            return
+        self.published_frames += 1
+        try:
+            self._loop.call_soon_threadsafe(self._fan_out, frame)
+        except RuntimeError:
+            logger.debug("Event loop closed; dropping live stream frame.")
+
+    def _fan_out(self, frame: StreamFrame):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.push(frame)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clients = list(self._clients)
+        return {
+            "clients": len(clients),
+            "buffer_size": self.buffer_size,
+            "published_frames": self.published_frames,
+            "dropped_frames": sum(client.dropped_frames for client in clients)
+        }
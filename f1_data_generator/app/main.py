@@ -1,19 +1,38 @@
+from app.startup_timing import StartupTimer
+
+startup_timer = StartupTimer()
+
 import os
 import logging
 import random 
 import datetime
 import requests
 import time
-import pandas as pd
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Query
+import json
+import asyncio
+import gc
+import threading
+import numpy as np
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Iterator
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from dotenv import load_dotenv
-from fastapi.responses import JSONResponse
-import fastf1
-import fastf1.core
-import fastf1.api
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.websockets import WebSocketState
+
+from app.telemetry_store import SessionTelemetryStore, build_session_store
+from app.live_stream import TickBroadcaster, StreamFrame, STREAM_FORMATS
+from app.race_order import compute_running_order
+from app.rollups import ensure_rollup_tables, maintain_rollups, query_series
+from app.track_index import TrackIndex
+from app.shared_store import session_store_directory, publish_session_store, read_published_version, load_session_store
+
+if TYPE_CHECKING:
+    import fastf1.core
+    import pandas as pd
+
+startup_timer.mark("imports")
 
 
 load_dotenv() 
@@ -22,6 +41,7 @@ app_start_time = time.time()
 
 
 ORION_URL = os.getenv("ORION_URL", "http://localhost:1026") 
+CRATE_URL = os.getenv("CRATE_URL", "http://localhost:4200")
 SESSION_KEY = int(os.getenv("SESSION_KEY", 12345))
 RACE_SESSION_ID = f"urn:ngsi-v2:RaceSession:{SESSION_KEY}"
 
@@ -29,9 +49,19 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
 SCHEDULE_INTERVAL_SECONDS = int(os.getenv("SCHEDULE_INTERVAL_SECONDS", 10))
 
+RANGE_MAX_SAMPLES = int(os.getenv("RANGE_MAX_SAMPLES", 200000))
+RANGE_STREAM_CHUNK_SIZE = int(os.getenv("RANGE_STREAM_CHUNK_SIZE", 5000))
+
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL_SECONDS", 60))
+ROLLUP_LATE_SECONDS = float(os.getenv("ROLLUP_LATE_SECONDS", 30))
+ROLLUP_LAP_LOOKBACK_SECONDS = float(os.getenv("ROLLUP_LAP_LOOKBACK_SECONDS", 900))
+RAW_RETENTION_HOURS = float(os.getenv("RAW_RETENTION_HOURS", 0))
+HISTORY_DEFAULT_POINTS = int(os.getenv("HISTORY_DEFAULT_POINTS", 1000))
+
 GENERATOR_YEAR = int(os.getenv("GENERATOR_YEAR", 2023))
 GENERATOR_GP = os.getenv("GENERATOR_GP", "Monza")
 GENERATOR_SESSION = os.getenv("GENERATOR_SESSION", "R")
+TRACK_MINI_SECTOR_COUNT = int(os.getenv("TRACK_MINI_SECTOR_COUNT", 25))
 
 TARGET_DRIVER_CODE = os.getenv("TARGET_DRIVER_CODE")
 if not TARGET_DRIVER_CODE:
@@ -41,6 +71,22 @@ if not TARGET_DRIVER_CODE:
 
 ACTIVE_DRIVER_CODES = [TARGET_DRIVER_CODE.upper()] 
 
+STREAM_INTERVAL_SECONDS = float(os.getenv("STREAM_INTERVAL_SECONDS", 0.1))
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", 32))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", 15))
+GENERATOR_MODES = ("embedded", "worker", "api")
+GENERATOR_MODE = os.getenv("GENERATOR_MODE", "embedded").lower()
+if GENERATOR_MODE not in GENERATOR_MODES:
+    raise ValueError(f"GENERATOR_MODE must be one of {list(GENERATOR_MODES)}, got '{GENERATOR_MODE}'.")
+
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH")
+if GENERATOR_MODE != "embedded" and not SHARED_STORE_PATH:
+    raise ValueError(f"SHARED_STORE_PATH environment variable must be set when GENERATOR_MODE={GENERATOR_MODE}. Example: SHARED_STORE_PATH=/dev/shm/f1_store")
+SHARED_STORE_DIRECTORY = session_store_directory(SHARED_STORE_PATH, GENERATOR_YEAR, GENERATOR_GP, GENERATOR_SESSION) if SHARED_STORE_PATH else None
+SHARED_STORE_REFRESH_SECONDS = float(os.getenv("SHARED_STORE_REFRESH_SECONDS", 30))
+
+STREAM_DRIVER_CODES = [code.strip().upper() for code in os.getenv("STREAM_DRIVER_CODES", "").split(",") if code.strip()] or ACTIVE_DRIVER_CODES
+
 logging.basicConfig(
     level=LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -53,45 +99,134 @@ logger.info(f"Generator Interval: {SCHEDULE_INTERVAL_SECONDS} seconds")
 logger.info(f"Generator Source Data: {GENERATOR_YEAR} {GENERATOR_GP} {GENERATOR_SESSION}")
 logger.info(f"--- TARGETING SINGLE DRIVER ---")
 logger.info(f"Target driver: {ACTIVE_DRIVER_CODES[0]}")
+logger.info(f"Generator mode: {GENERATOR_MODE}" + (f" (shared store: {SHARED_STORE_DIRECTORY})" if SHARED_STORE_DIRECTORY else ""))
 logger.info(f"Simulation Session Key: {SESSION_KEY}")
+logger.info(f"Live stream: interval={STREAM_INTERVAL_SECONDS}s, drivers={STREAM_DRIVER_CODES}, buffer={STREAM_BUFFER_SIZE} frames/client")
 logger.info(f"Simulation t=0 (App Start Time): {datetime.datetime.fromtimestamp(app_start_time).isoformat()}")
 
 
-cache_path_env = os.getenv("FASTF1_CACHE_PATH")
-default_cache_path_local = './fastf1_cache' 
-cache_path = None
+startup_timer.mark("config")
 
-if cache_path_env:
-    cache_path = cache_path_env
-    logger.info(f"Using cache path from FASTF1_CACHE_PATH env var: {cache_path}")
-else:
-    if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ or 'FUNCTION_TARGET' in os.environ or 'K_SERVICE' in os.environ or 'RUNNING_IN_DOCKER' in os.environ: 
-        cache_path = '/tmp/fastf1_cache'
-        logger.info(f"Detected container/serverless environment, using cache path: {cache_path}")
-    else:
-        cache_path = default_cache_path_local
-        logger.info(f"Using default local cache path: {cache_path}")
-try:
-    if not os.path.exists(cache_path):
-        os.makedirs(cache_path)
-        logger.info(f"Created cache directory: {cache_path}")
+fastf1_cache_path = None
+_fastf1_module = None
+_fastf1_lock = threading.Lock()
+
+def configure_fastf1_cache(fastf1_module):
+    """Enables the FastF1 cache at the configured or environment-appropriate path."""
+    global fastf1_cache_path
+    cache_path_env = os.getenv("FASTF1_CACHE_PATH")
+    default_cache_path_local = './fastf1_cache' 
+    cache_path = None
+
+    if cache_path_env:
+        cache_path = cache_path_env
+        logger.info(f"Using cache path from FASTF1_CACHE_PATH env var: {cache_path}")
     else:
-        if not os.access(cache_path, os.W_OK):
-             logger.warning(f"Cache directory '{cache_path}' exists but is NOT WRITABLE by the current user. Cache will likely fail.")
+        if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ or 'FUNCTION_TARGET' in os.environ or 'K_SERVICE' in os.environ or 'RUNNING_IN_DOCKER' in os.environ: 
+            cache_path = '/tmp/fastf1_cache'
+            logger.info(f"Detected container/serverless environment, using cache path: {cache_path}")
         else:
-            logger.info(f"Using existing cache directory: {cache_path}")
-    fastf1.Cache.enable_cache(cache_path)
-    logger.info(f"FastF1 cache enabled at path: {cache_path}")
-except PermissionError as e:
-     logger.error(f"Permission denied configuring FastF1 cache at {cache_path}: {e}. Ensure the directory is writable by user '{os.getuid()}'. Caching disabled, performance severely impacted.")
-except Exception as e:
-    logger.warning(f"Could not configure FastF1 cache at {cache_path}: {e}. Performance might be impacted.")
-
-generator_f1_session_cache = None
-generator_laps_cache = {} 
+            cache_path = default_cache_path_local
+            logger.info(f"Using default local cache path: {cache_path}")
+    try:
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+            logger.info(f"Created cache directory: {cache_path}")
+        else:
+            if not os.access(cache_path, os.W_OK):
+                 logger.warning(f"Cache directory '{cache_path}' exists but is NOT WRITABLE by the current user. Cache will likely fail.")
+            else:
+                logger.info(f"Using existing cache directory: {cache_path}")
+        fastf1_module.Cache.enable_cache(cache_path)
+        fastf1_cache_path = cache_path
+        logger.info(f"FastF1 cache enabled at path: {cache_path}")
+    except PermissionError as e:
+         logger.error(f"Permission denied configuring FastF1 cache at {cache_path}: {e}. Ensure the directory is writable by user '{os.getuid()}'. Caching disabled, performance severely impacted.")
+    except Exception as e:
+        logger.warning(f"Could not configure FastF1 cache at {cache_path}: {e}. Performance might be impacted.")
+
+def get_fastf1():
+    """Imports FastF1 and enables its cache on first use, keeping both off the startup path."""
+    global _fastf1_module
+    if _fastf1_module is not None:
+        return _fastf1_module
+    with _fastf1_lock:
+        if _fastf1_module is None:
+            with startup_timer.phase("fastf1_import"):
+                import fastf1
+                import fastf1.core
+                import fastf1.api
+            with startup_timer.phase("fastf1_cache_setup"):
+                configure_fastf1_cache(fastf1)
+            _fastf1_module = fastf1
+    return _fastf1_module
+
+generator_store: Optional[SessionTelemetryStore] = None
+generator_store_version: Optional[str] = None
+generator_store_checked_at = 0.0
+generator_store_lock = threading.Lock()
 
 app = FastAPI(title="F1 Data Generator and Simulation Service (Single Driver)")
 scheduler = BackgroundScheduler(daemon=True)
+broadcaster = TickBroadcaster(buffer_size=STREAM_BUFFER_SIZE)
+
+startup_timer.mark("app_setup")
+
+def get_shared_generator_store() -> SessionTelemetryStore:
+    """
+    API mode: maps the store published by the generator worker. The CURRENT pointer is
+    re-checked every SHARED_STORE_REFRESH_SECONDS so a restarted worker is picked up,
+    and the simulation clock follows the worker's origin so all processes agree on t.
+    """
+    global generator_store, generator_store_version, generator_store_checked_at, app_start_time
+    if generator_store is not None and time.monotonic() - generator_store_checked_at < SHARED_STORE_REFRESH_SECONDS:
+        return generator_store
+
+    with generator_store_lock:
+        version = read_published_version(SHARED_STORE_DIRECTORY)
+        generator_store_checked_at = time.monotonic()
+        if version is None:
+            if generator_store is not None:
+                return generator_store
+            raise RuntimeError(f"The generator worker has not published session data to {SHARED_STORE_DIRECTORY} yet.")
+        if version != generator_store_version:
+            with startup_timer.phase("shared_store_map"):
+                store, meta = load_session_store(SHARED_STORE_DIRECTORY, version)
+            generator_store, generator_store_version = store, version
+            app_start_time = meta["simulation_origin_epoch"]
+            logger.info(f"Mapped telemetry store version {version} ({len(store.drivers)} drivers). Simulation t=0: {datetime.datetime.fromtimestamp(app_start_time).isoformat()}")
+    return generator_store
+
+def get_generator_store() -> SessionTelemetryStore:
+    """
+    Returns the compact telemetry store of the generator session, loading the FastF1
+    session on first use. The session object is dropped as soon as the arrays are built.
+    In worker mode the store is also published for the API processes.
+    """
+    global generator_store, generator_store_version
+    if GENERATOR_MODE == "api":
+        return get_shared_generator_store()
+    if generator_store is not None:
+        return generator_store
+
+    with generator_store_lock:
+        if generator_store is None:
+            logger.info(f"Generator store empty. Loading base session data for {GENERATOR_YEAR} {GENERATOR_GP} {GENERATOR_SESSION}...")
+            fastf1 = get_fastf1()
+            with startup_timer.phase("generator_session_load"):
+                f1_session = fastf1.get_session(GENERATOR_YEAR, GENERATOR_GP, GENERATOR_SESSION)
+                f1_session.load(laps=True, telemetry=True, weather=False, messages=False)
+            with startup_timer.phase("telemetry_extraction"):
+                store = build_session_store(f1_session, GENERATOR_YEAR, GENERATOR_SESSION, mini_sector_count=TRACK_MINI_SECTOR_COUNT)
+            del f1_session
+            gc.collect()
+            if not store.drivers:
+                raise RuntimeError(f"No driver telemetry could be extracted from {GENERATOR_YEAR} {GENERATOR_GP} {GENERATOR_SESSION}.")
+            if GENERATOR_MODE == "worker":
+                with startup_timer.phase("shared_store_publish"):
+                    generator_store_version = publish_session_store(store, SHARED_STORE_DIRECTORY, app_start_time)
+            generator_store = store
+    return generator_store
 
 def get_telemetry_at_simulated_time(
     driver_code: str,
@@ -99,12 +234,14 @@ def get_telemetry_at_simulated_time(
     gp: str,
     session_identifier: str,
     simulated_race_time_seconds: float,
-    cached_session: Optional[fastf1.core.Session] = None,
-    cached_laps_df: Optional[pd.DataFrame] = None
+    cached_session: Optional["fastf1.core.Session"] = None,
+    cached_laps_df: Optional["pd.DataFrame"] = None
 ) -> Dict[str, Any]:
     """
     Fetches historical telemetry including X/Y position corresponding to a simulated race time.
     """
+    fastf1 = get_fastf1()
+    import pandas as pd
     logger.debug(f"Getting telemetry for {driver_code} at simulated time {simulated_race_time_seconds:.3f}s for {year} {gp} {session_identifier}")
 
     f1_session = cached_session
@@ -317,14 +454,14 @@ async def get_simulated_live_telemetry(
 
     return result
 
-def format_to_ngsi_v2(telemetry_data: Dict[str, Any], current_timestamp: datetime.datetime) -> Optional[Dict[str, Any]]:
-    """Formats the fetched telemetry data (including X,Y) into an NGSI-v2 entity."""
+def format_to_ngsi_v2(telemetry_data: Dict[str, Any], current_timestamp: datetime.datetime, session_key: int = SESSION_KEY) -> Optional[Dict[str, Any]]:
+    """Formats the fetched telemetry data (including X,Y) into an NGSI-v2 entity of simulation session `session_key`."""
     required_keys = ["driver_code", "speed", "rpm", "gear", "throttle", "brake", "drs", "distance", "target_lap_number", "calculated_time_within_lap_seconds", "x", "y"]
     if not all(key in telemetry_data for key in required_keys):
         logger.warning(f"Missing essential keys in telemetry data for driver {telemetry_data.get('driver_code', 'N/A')}. Cannot format to NGSI-v2. Data: {telemetry_data}")
         return None
 
-    entity_id = f"urn:ngsi-v2:Car:{telemetry_data['driver_code']}:{SESSION_KEY}"
+    entity_id = f"urn:ngsi-v2:Car:{telemetry_data['driver_code']}:{session_key}"
     entity_type = "Car"
 
     ngsi_entity = {
@@ -363,12 +500,20 @@ def format_to_ngsi_v2(telemetry_data: Dict[str, Any], current_timestamp: datetim
             "type": "DateTime",
             "value": current_timestamp.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
         },
-        "simulationSessionKey": {"type": "Number", "value": SESSION_KEY},
+        "simulationSessionKey": {"type": "Number", "value": session_key},
         "refRaceSession": {
             "type": "Relationship",
-            "value": RACE_SESSION_ID
+            "value": f"urn:ngsi-v2:RaceSession:{session_key}"
         }
     }
+    if telemetry_data.get("race_position") is not None:
+        ngsi_entity["racePosition"] = {"type": "Number", "value": telemetry_data["race_position"]}
+        ngsi_entity["gapToLeader"] = {"type": "Number", "value": telemetry_data.get("gap_to_leader"), "metadata": {"unitCode": {"value": "SEC"}}}
+        ngsi_entity["intervalToCarAhead"] = {"type": "Number", "value": telemetry_data.get("interval_to_car_ahead"), "metadata": {"unitCode": {"value": "SEC"}}}
+        ngsi_entity["carAhead"] = {"type": "Text", "value": telemetry_data.get("car_ahead") or ""}
+    if telemetry_data.get("sector") is not None:
+        ngsi_entity["sector"] = {"type": "Number", "value": telemetry_data["sector"]}
+        ngsi_entity["miniSector"] = {"type": "Number", "value": telemetry_data["mini_sector"]}
     return ngsi_entity
 
 def send_to_orion(entities: List[Dict[str, Any]]):
@@ -406,10 +551,28 @@ def send_to_orion(entities: List[Dict[str, Any]]):
         logger.error(f"An unexpected error occurred during Orion update: {e}")
 
 
+def add_running_order(store: SessionTelemetryStore, simulated_race_time_seconds: float, points: List[Dict[str, Any]]):
+    """Adds race position, gap to leader and interval to the car ahead to sampled points, computed across the whole grid."""
+    try:
+        standings = compute_running_order(store, simulated_race_time_seconds)
+    except Exception as e:
+        logger.warning(f"Could not compute running order at {simulated_race_time_seconds:.3f}s: {e}")
+        return
+    for point in points:
+        point.update(standings.get(point["driver_code"], {}))
+
+def add_track_position(store: SessionTelemetryStore, points: List[Dict[str, Any]]):
+    """Adds sector, mini-sector and lap fraction to sampled points from their X/Y, in one batched track index lookup."""
+    if store.track_index is None or not points:
+        return
+    located = store.track_index.locate([point["x"] for point in points], [point["y"] for point in points])
+    for i, point in enumerate(points):
+        point["sector"] = int(located["sector"][i])
+        point["mini_sector"] = int(located["mini_sector"][i])
+        point["lap_fraction"] = round(float(located["lap_fraction"][i]), 4)
+
 def generate_and_push_data():
     """Generates data for the single target driver and pushes to Orion."""
-    global generator_f1_session_cache, generator_laps_cache
-
     if not ACTIVE_DRIVER_CODES:
         logger.error("No active driver code configured. Skipping generation.")
         return
@@ -422,45 +585,20 @@ def generate_and_push_data():
     logger.info(f"--- Running Generator Cycle for {driver_code} (Simulated Time: {simulated_race_time_seconds:.3f}s) ---")
 
     try:
-        if generator_f1_session_cache is None:
-            logger.info(f"Generator cache empty. Loading base session data for {GENERATOR_YEAR} {GENERATOR_GP} {GENERATOR_SESSION}...")
-            generator_f1_session_cache = fastf1.get_session(GENERATOR_YEAR, GENERATOR_GP, GENERATOR_SESSION)
-            generator_f1_session_cache.load(laps=True, telemetry=False, weather=False, messages=False)
-            logger.info("Base session laps loaded into generator cache.")
-            generator_laps_cache = {} 
-        elif not hasattr(generator_f1_session_cache, 'f1_api_support') or not generator_f1_session_cache.f1_api_support:
-             logger.warning("Cached session reports no F1 API support or invalid. Reloading...")
-             generator_f1_session_cache = None
-             return 
+        store = get_generator_store()
     except Exception as e:
         logger.error(f"Failed to load or prepare generator session data: {e}. Skipping cycle.")
-        generator_f1_session_cache = None
-        generator_laps_cache = {}
         return
 
     logger.debug(f"Processing driver: {driver_code}")
-    driver_laps_df = generator_laps_cache.get(driver_code)
-
-    raw_data = get_telemetry_at_simulated_time(
-        driver_code=driver_code,
-        year=GENERATOR_YEAR,
-        gp=GENERATOR_GP,
-        session_identifier=GENERATOR_SESSION,
-        simulated_race_time_seconds=simulated_race_time_seconds,
-        cached_session=generator_f1_session_cache,
-        cached_laps_df=driver_laps_df
-    )
+    raw_data = store.sample_point(driver_code, simulated_race_time_seconds)
 
     ngsi_entity = None
-    if raw_data.get("status") == "error":
-        logger.warning(f"Generator: Failed to get data for {driver_code}: {raw_data.get('message')}")
-    elif raw_data.get("status") == "partial_no_telemetry":
-         logger.warning(f"Generator: Partial data (no telemetry) for {driver_code} at lap {raw_data.get('target_lap_number', 'N/A')}.")
+    if raw_data is None:
+        logger.warning(f"Generator: Failed to get data for {driver_code}: no laps with telemetry in the generator session.")
     else:
-        if driver_laps_df is None and raw_data.get("_laps_ref") is not None:
-             logger.debug(f"Caching laps dataframe for driver {driver_code}")
-             generator_laps_cache[driver_code] = raw_data.get("_laps_ref")
-
+        add_running_order(store, simulated_race_time_seconds, [raw_data])
+        add_track_position(store, [raw_data])
         ngsi_entity = format_to_ngsi_v2(raw_data, now_utc)
         if not ngsi_entity:
              logger.warning(f"Generator: Could not format NGSI entity for {driver_code}, likely missing data in result.")
@@ -473,26 +611,136 @@ def generate_and_push_data():
 
     logger.info(f"--- Generator Cycle Finished for {driver_code} ---")
 
+def format_stream_car_state(point: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps a sampled telemetry point to the compact car state sent to live stream clients."""
+    return {
+        "id": f"urn:ngsi-v2:Car:{point['driver_code']}:{SESSION_KEY}",
+        "driverCode": point["driver_code"],
+        "lapNumber": point["target_lap_number"],
+        "timeWithinLap": point["calculated_time_within_lap_seconds"],
+        "distance": point["distance"],
+        "speed": point["speed"],
+        "rpm": point["rpm"],
+        "gear": point["gear"],
+        "throttle": point["throttle"],
+        "brake": point["brake"],
+        "drs": point["drs"],
+        "x": point["x"],
+        "y": point["y"],
+        "racePosition": point.get("race_position"),
+        "gapToLeader": point.get("gap_to_leader"),
+        "intervalToCarAhead": point.get("interval_to_car_ahead"),
+        "carAhead": point.get("car_ahead"),
+        "sector": point.get("sector"),
+        "miniSector": point.get("mini_sector"),
+        "lapFraction": point.get("lap_fraction")
+    }
+
+def publish_live_stream_tick():
+    """Samples the stream drivers at the current simulated time and fans the states out to live clients."""
+    if broadcaster.client_count == 0:
+        return
+
+    current_time = time.time()
+    simulated_race_time_seconds = max(0.0, current_time - app_start_time)
+
+    try:
+        store = get_generator_store()
+    except Exception as e:
+        logger.error(f"Live stream: failed to prepare generator session data: {e}")
+        return
+
+    points = []
+    for driver_code in STREAM_DRIVER_CODES:
+        point = store.sample_point(driver_code, simulated_race_time_seconds)
+        if point is None:
+            logger.debug(f"Live stream: no telemetry available for {driver_code}.")
+            continue
+        points.append(point)
+
+    if not points:
+        return
+    add_running_order(store, simulated_race_time_seconds, points)
+    add_track_position(store, points)
+    cars = [format_stream_car_state(point) for point in points]
+
+    observed_at = datetime.datetime.fromtimestamp(current_time, tz=datetime.timezone.utc)
+    broadcaster.publish(StreamFrame(
+        simulated_elapsed_time=round(simulated_race_time_seconds, 3),
+        observed_at_epoch=current_time,
+        date_observed=observed_at.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        cars=cars
+    ))
+
+rollup_tables_ready = False
+
+def refresh_etcar_rollups():
+    """Scheduled pass over CrateDB: extends the etcar rollup tiers and applies raw retention."""
+    global rollup_tables_ready
+    try:
+        if not rollup_tables_ready:
+            ensure_rollup_tables(CRATE_URL)
+            rollup_tables_ready = True
+        maintain_rollups(CRATE_URL, ROLLUP_LATE_SECONDS, ROLLUP_LAP_LOOKBACK_SECONDS, RAW_RETENTION_HOURS)
+    except Exception as e:
+        logger.error(f"Rollup refresh failed: {e}")
+
+def add_rollup_job(job_scheduler):
+    if ROLLUP_INTERVAL_SECONDS <= 0:
+        logger.info("ROLLUP_INTERVAL_SECONDS <= 0: etcar rollups disabled.")
+        return
+    job_scheduler.add_job(
+        refresh_etcar_rollups,
+        trigger=IntervalTrigger(seconds=ROLLUP_INTERVAL_SECONDS),
+        id="etcar_rollup_job",
+        name="etcar Rollups and Raw Retention",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=max(1, int(ROLLUP_INTERVAL_SECONDS))
+    )
+
 @app.on_event("startup")
 async def startup_event():
     """Starts the background scheduler when the app starts."""
     logger.info("Application startup...")
-    logger.info("Scheduling background data generation job...")
-    scheduler.add_job(
-        generate_and_push_data,
-        trigger=IntervalTrigger(seconds=SCHEDULE_INTERVAL_SECONDS),
-        id="f1_data_job",
-        name="F1 Data Generation and Push",
-        replace_existing=True,
-        max_instances=1,
-        misfire_grace_time=10 
-    )
-    scheduler.start()
-    time.sleep(1)
+    broadcaster.attach_loop(asyncio.get_running_loop())
+    startup_timer.mark("uvicorn_boot")
+    if GENERATOR_MODE == "embedded":
+        logger.info("Scheduling background data generation job...")
+        scheduler.add_job(
+            generate_and_push_data,
+            trigger=IntervalTrigger(seconds=SCHEDULE_INTERVAL_SECONDS),
+            id="f1_data_job",
+            name="F1 Data Generation and Push",
+            replace_existing=True,
+            max_instances=1,
+            misfire_grace_time=10 
+        )
+        add_rollup_job(scheduler)
+    else:
+        logger.info(f"GENERATOR_MODE={GENERATOR_MODE}: Orion updates are pushed by the dedicated generator worker, not this API process.")
+    if STREAM_INTERVAL_SECONDS > 0:
+        scheduler.add_job(
+            publish_live_stream_tick,
+            trigger=IntervalTrigger(seconds=STREAM_INTERVAL_SECONDS),
+            id="f1_live_stream_job",
+            name="F1 Live Stream Fan-out",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=1
+        )
+    else:
+        logger.info("STREAM_INTERVAL_SECONDS <= 0: live stream fan-out disabled.")
+    with startup_timer.phase("scheduler_start"):
+        scheduler.start()
     if scheduler.running:
-        logger.info(f"Scheduler started. Job 'f1_data_job' scheduled to run every {SCHEDULE_INTERVAL_SECONDS} seconds.")
+        logger.info(f"Scheduler started with jobs: {[job.id for job in scheduler.get_jobs()]}.")
     else:
         logger.error("Scheduler failed to start.")
+    startup_timer.mark_ready()
+    startup_timer.log_report()
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -508,9 +756,8 @@ async def shutdown_event():
 
 @app.get("/", summary="Service Information")
 async def root():
-    global generator_f1_session_cache
-    session_loaded = generator_f1_session_cache is not None
-    cache_status = "Enabled" if fastf1.Cache.is_enabled() else "Disabled"
+    session_loaded = generator_store is not None
+    cache_status = "Enabled" if fastf1_cache_path else ("Disabled" if _fastf1_module is not None else "Not configured yet (deferred until first use)")
     return {
         "service": "F1 Data Generator and Simulation Service (Single Driver)",
         "status": "running",
@@ -521,16 +768,38 @@ async def root():
             "interval_seconds": SCHEDULE_INTERVAL_SECONDS,
             "target_driver": ACTIVE_DRIVER_CODES[0], # Show the target driver
             "simulation_session_key": SESSION_KEY,
-            "base_session_data_loaded": session_loaded
+            "base_session_data_loaded": session_loaded,
+            "mode": GENERATOR_MODE,
+            "shared_store_version": generator_store_version
         },
         "fastf1_cache": {
             "status": cache_status,
-            "path": fastf1.Cache.get_cache_path() if fastf1.Cache.is_enabled() else "N/A"
+            "path": fastf1_cache_path or "N/A"
         },
         "scheduler_running": scheduler.running,
+        "live_stream": broadcaster.stats(),
         "simulation_time_origin_utc": datetime.datetime.fromtimestamp(app_start_time, tz=datetime.timezone.utc).isoformat()
     }
 
+@app.get("/api/v1/f1data/memory", summary="Telemetry Store Memory Report")
+async def get_memory_report():
+    """Size of the compact telemetry store compared with the FastF1 session it replaced."""
+    if generator_store is None:
+        return {"loaded": False, "mode": GENERATOR_MODE}
+    return {
+        "loaded": True,
+        "mode": GENERATOR_MODE,
+        "backing": "memory-mapped files" if GENERATOR_MODE == "api" else "process heap",
+        "shared_store_directory": SHARED_STORE_DIRECTORY,
+        "shared_store_version": generator_store_version,
+        **generator_store.memory_report()
+    }
+
+@app.get("/api/v1/f1data/startup", summary="Startup Time Report")
+async def get_startup_report():
+    """Startup phases with their durations, including phases deferred until first use."""
+    return startup_timer.report()
+
 @app.get("/health", summary="Health Check")
 async def health_check():
     orion_status = "unknown"
@@ -557,21 +826,16 @@ async def get_debug_data_point(
      logger.debug(f"Generating debug data sample for {driver_code} at time {simulated_time}s.")
      now_utc = datetime.datetime.now(datetime.timezone.utc)
 
-     session_to_use = generator_f1_session_cache
-     laps_to_use = generator_laps_cache.get(driver_code)
+     try:
+         store = get_generator_store()
+     except Exception as e:
+         raise HTTPException(status_code=503, detail=f"Generator session data not available: {e}")
 
-     raw_data = get_telemetry_at_simulated_time(
-         driver_code=driver_code,
-         year=GENERATOR_YEAR,
-         gp=GENERATOR_GP,
-         session_identifier=GENERATOR_SESSION,
-         simulated_race_time_seconds=simulated_time,
-         cached_session=session_to_use,
-         cached_laps_df=laps_to_use
-     )
-
-     if raw_data.get("status") in ["error", "partial_no_telemetry"]:
-         raise HTTPException(status_code=404, detail=raw_data.get("message", "Could not generate debug data point."))
+     raw_data = store.sample_point(driver_code, simulated_time)
+     if raw_data is None:
+         raise HTTPException(status_code=404, detail=f"No telemetry for driver '{driver_code}' in the generator session.")
+     add_running_order(store, simulated_time, [raw_data])
+     add_track_position(store, [raw_data])
 
      ngsi_entity = format_to_ngsi_v2(raw_data, now_utc)
      if ngsi_entity:
@@ -580,6 +844,262 @@ async def get_debug_data_point(
           raise HTTPException(status_code=500, detail="Failed to format generated data into NGSI-v2.")
 
 
+RANGE_FORMATS = ("json", "ndjson", "binary")
+
+RANGE_RECORD_DTYPE = np.dtype([
+    ("driver_code", "S3"),
+    ("status", "u1"),
+    ("simulated_elapsed_race_time_seconds", "<f8"),
+    ("target_lap_number", "<i2"),
+    ("calculated_time_within_lap_seconds", "<f4"),
+    ("distance", "<f4"),
+    ("speed", "<f4"),
+    ("drs", "?"),
+    ("gear", "i1"),
+    ("rpm", "<i4"),
+    ("brake", "i1"),
+    ("throttle", "<i2"),
+    ("x", "<f4"),
+    ("y", "<f4"),
+])
+
+RANGE_FIELDS = [name for name in RANGE_RECORD_DTYPE.names if name != "driver_code"]
+
+
+def _iter_range_ndjson(samples: Dict[str, Dict[str, np.ndarray]]) -> Iterator[bytes]:
+    for driver_code, columns in samples.items():
+        values = [columns[field].tolist() for field in RANGE_FIELDS]
+        row_count = len(values[0])
+        for chunk_start in range(0, row_count, RANGE_STREAM_CHUNK_SIZE):
+            lines = []
+            for row in zip(*(column[chunk_start:chunk_start + RANGE_STREAM_CHUNK_SIZE] for column in values)):
+                record = dict(zip(RANGE_FIELDS, row))
+                record["driver_code"] = driver_code
+                lines.append(json.dumps(record, separators=(",", ":")))
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _iter_range_binary(samples: Dict[str, Dict[str, np.ndarray]]) -> Iterator[bytes]:
+    for driver_code, columns in samples.items():
+        records = np.empty(len(columns["status"]), dtype=RANGE_RECORD_DTYPE)
+        records["driver_code"] = driver_code
+        for field in RANGE_FIELDS:
+            records[field] = columns[field]
+        for chunk_start in range(0, records.shape[0], RANGE_STREAM_CHUNK_SIZE):
+            yield records[chunk_start:chunk_start + RANGE_STREAM_CHUNK_SIZE].tobytes()
+
+
+@app.get("/api/v1/f1data/range", summary="Telemetry Over a Time Window")
+def get_telemetry_range(
+    t_end: float = Query(..., description="End of the window in simulated seconds since start (inclusive)", ge=0.0),
+    t_start: float = Query(0.0, description="Start of the window in simulated seconds since start", ge=0.0),
+    step: float = Query(1.0, description="Seconds between samples", gt=0.0),
+    drivers: Optional[str] = Query(None, description="Comma-separated driver codes (defaults to the target driver)", example="NOR,VER"),
+    format: str = Query("json", description="Response format: json (columnar), ndjson (streamed rows) or binary (streamed packed records)")
+):
+    """
+    Returns the generator session's telemetry for a set of drivers over [t_start, t_end]
+    at the requested resolution, computed in one vectorized pass per driver.
+
+    `binary` streams little-endian packed records; the record layout is described by the
+    `X-Record-Dtype` response header (numpy dtype descr as JSON). The `status` field is
+    0 for data found, 1 before the historical race start, 2 after the finish, 3 for a lap
+    without telemetry, interpolated along the track. t=0 is the race start for every car.
+    """
+    if format not in RANGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{format}'. Expected one of {list(RANGE_FORMATS)}.")
+    if not all(np.isfinite(value) for value in (t_start, t_end, step)):
+        raise HTTPException(status_code=400, detail="t_start, t_end and step must be finite numbers.")
+    if t_end < t_start:
+        raise HTTPException(status_code=400, detail="t_end must be greater than or equal to t_start.")
+
+    sample_count = int(np.floor((t_end - t_start) / step + 1e-9)) + 1
+    if sample_count > RANGE_MAX_SAMPLES:
+        raise HTTPException(status_code=400, detail=f"Window yields {sample_count} samples per driver; the maximum is {RANGE_MAX_SAMPLES}. Increase step or narrow the window.")
+
+    driver_codes = [code.strip().upper() for code in drivers.split(",") if code.strip()] if drivers else list(ACTIVE_DRIVER_CODES)
+    if not driver_codes:
+        raise HTTPException(status_code=400, detail="No driver codes given.")
+
+    simulated_times = t_start + step * np.arange(sample_count, dtype=np.float64)
+    logger.info(f"Range Request: drivers={driver_codes}, window=[{t_start}, {t_end}]s, step={step}s, samples={sample_count}, format={format}")
+
+    samples: Dict[str, Dict[str, np.ndarray]] = {}
+    for driver_code in driver_codes:
+        try:
+            columns = get_generator_store().sample(driver_code, simulated_times)
+        except Exception as e:
+            logger.exception(f"Failed to prepare telemetry arrays for {driver_code}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to prepare telemetry for driver '{driver_code}': {e}")
+        if columns is None:
+            raise HTTPException(status_code=404, detail=f"No laps found for driver '{driver_code}' in the generator session.")
+        samples[driver_code] = columns
+
+    if format == "ndjson":
+        return StreamingResponse(_iter_range_ndjson(samples), media_type="application/x-ndjson")
+    if format == "binary":
+        return StreamingResponse(
+            _iter_range_binary(samples),
+            media_type="application/octet-stream",
+            headers={"X-Record-Dtype": json.dumps(RANGE_RECORD_DTYPE.descr)}
+        )
+
+    return {
+        "year": GENERATOR_YEAR,
+        "gp": GENERATOR_GP,
+        "session": GENERATOR_SESSION,
+        "t_start": t_start,
+        "t_end": t_end,
+        "step": step,
+        "sample_count": sample_count,
+        "drivers": {
+            driver_code: {field: columns[field].tolist() for field in RANGE_FIELDS}
+            for driver_code, columns in samples.items()
+        }
+    }
+
+
+def get_generator_track_index() -> TrackIndex:
+    try:
+        store = get_generator_store()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Generator session data not available: {e}")
+    if store.track_index is None:
+        raise HTTPException(status_code=404, detail="No track index could be built for the generator session.")
+    return store.track_index
+
+@app.get("/api/v1/f1data/track", summary="Track Centreline and Sectors")
+async def get_track_layout():
+    """Centreline of the generator session's circuit with lap distance, sector ends and mini-sector boundaries."""
+    return {
+        "year": GENERATOR_YEAR,
+        "gp": GENERATOR_GP,
+        "session": GENERATOR_SESSION,
+        **get_generator_track_index().describe()
+    }
+
+@app.get("/api/v1/f1data/track/locate", summary="Map X/Y to Track Distance, Sector and Mini-Sector")
+async def locate_on_track(
+    x: str = Query(..., description="Comma-separated X positions", example="-1200.5,3410"),
+    y: str = Query(..., description="Comma-separated Y positions, one per X", example="880,-2750.25")
+):
+    """Batched lookup of positions on the generator session's circuit. Lateral offset is in X/Y units."""
+    try:
+        xs = [float(value) for value in x.split(",")]
+        ys = [float(value) for value in y.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="x and y must be comma-separated numbers.")
+    if len(xs) != len(ys):
+        raise HTTPException(status_code=400, detail=f"Got {len(xs)} x values and {len(ys)} y values.")
+
+    located = get_generator_track_index().locate(xs, ys)
+    return {
+        "count": len(xs),
+        "positions": [
+            {
+                "x": xs[i],
+                "y": ys[i],
+                "distance": round(float(located["distance"][i]), 1),
+                "lap_fraction": round(float(located["lap_fraction"][i]), 4),
+                "sector": int(located["sector"][i]),
+                "mini_sector": int(located["mini_sector"][i]),
+                "lateral_offset": round(float(located["lateral_offset"][i]), 1)
+            }
+            for i in range(len(xs))
+        ]
+    }
+
+
+@app.get("/api/v1/f1data/history", summary="Long-Range Speed/RPM/DRS History")
+def get_history(
+    start: datetime.datetime = Query(..., description="Start of the range (ISO-8601)"),
+    end: datetime.datetime = Query(..., description="End of the range (ISO-8601)"),
+    driver: Optional[str] = Query(None, description="Driver code (defaults to the target driver)"),
+    points: int = Query(HISTORY_DEFAULT_POINTS, description="Points the panel can show, typically its width in pixels", ge=1)
+):
+    """
+    Per-car min/max/avg speed and RPM and DRS-open share over [start, end], read from the
+    coarsest rollup tier (raw, 1s, 10s, lap) that still gives at least `points` buckets.
+    Raw rows report their single sample as min, max and average.
+    """
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=datetime.timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=datetime.timezone.utc)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start.")
+    driver_code = (driver or ACTIVE_DRIVER_CODES[0]).upper()
+    entity_id = f"urn:ngsi-v2:Car:{driver_code}:{SESSION_KEY}"
+
+    try:
+        series = query_series(CRATE_URL, entity_id, start, end, points)
+    except Exception as e:
+        logger.error(f"History query for {entity_id} failed: {e}")
+        raise HTTPException(status_code=502, detail=f"CrateDB query failed: {e}")
+    logger.info(f"History Request: {entity_id} [{start.isoformat()}, {end.isoformat()}] at {points} points -> tier {series['tier']} ({series['row_count']} rows)")
+    return {"entity_id": entity_id, "start": start.isoformat(), "end": end.isoformat(), "points": points, **series}
+
+
+@app.websocket("/ws/cars")
+async def live_cars_websocket(websocket: WebSocket, format: str = "json"):
+    """
+    Pushes each live stream tick to the client. `format=json` sends text frames,
+    `format=binary` sends packed frames (see `app.live_stream` for the layout).
+    """
+    if format not in STREAM_FORMATS:
+        await websocket.close(code=1003)
+        return
+    await websocket.accept()
+    client = broadcaster.register()
+
+    async def drain_until_disconnect():
+        # Clients send nothing we use, but reading is how a close from the peer is observed.
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    reader = asyncio.ensure_future(drain_until_disconnect())
+    try:
+        # Wake up periodically even without ticks, so a socket closed while nothing is
+        # published is noticed and the client unregistered.
+        while not reader.done() and websocket.client_state == WebSocketState.CONNECTED:
+            frame = await client.next_frame(timeout=STREAM_KEEPALIVE_SECONDS)
+            if frame is None:
+                continue
+            if format == "binary":
+                await websocket.send_bytes(frame.binary)
+            else:
+                await websocket.send_text(frame.json_text)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning(f"Live stream WebSocket closed with error: {e}")
+    finally:
+        reader.cancel()
+        broadcaster.unregister(client)
+
+@app.get("/stream/cars", summary="Live Car States (Server-Sent Events)")
+async def live_cars_sse(request: Request):
+    """Server-Sent Events feed of each live stream tick as JSON."""
+    client = broadcaster.register()
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                frame = await client.next_frame(timeout=STREAM_KEEPALIVE_SECONDS)
+                if frame is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: tick\ndata: {frame.json_text}\n\n"
+        finally:
+            broadcaster.unregister(client)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 if __name__ == "__main__":
     if not TARGET_DRIVER_CODE:
         logger.error("Cannot start: TARGET_DRIVER_CODE environment variable is not set.")
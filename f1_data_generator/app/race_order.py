@@ -0,0 +1,75 @@
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.telemetry_store import SessionTelemetryStore
+
+
+logger = logging.getLogger(__name__)
+
+
+def _time_at_race_distance(profile: Tuple[np.ndarray, np.ndarray], race_distance_m: float) -> Optional[float]:
+    """
+    Session time (ms) at which a driver reached `race_distance_m`, interpolated on the
+    driver's race distance profile. Costs one binary search; returns None if the driver
+    never got that far.
+    """
+    times, distances = profile
+    if race_distance_m > distances[-1]:
+        return None
+    return float(np.interp(race_distance_m, distances, times))
+
+
+def compute_running_order(store: SessionTelemetryStore, simulated_race_time_seconds: float) -> Dict[str, Dict[str, Any]]:
+    """
+    Running order, gap to the leader and interval to the car ahead for every driver in
+    `store` at one simulated time.
+
+    Every car is sampled at the same session time, race start (the earliest first-lap
+    start across the grid) plus the simulated time, and ranked by race distance,
+    (lap - 1) * track length + distance into the lap, with finished cars ordered by when
+    they took the flag. Laps missing from the store are interpolated across. A gap is the
+    time between the reference car passing a point and this car passing the same point,
+    so it holds for lapped cars too. Gaps are seconds.
+    """
+    driver_codes = store.driver_codes
+    if not driver_codes or not store.track_length_m:
+        return {}
+
+    count = len(driver_codes)
+    profiles = [store.race_distance_profile(driver_code) for driver_code in driver_codes]
+    now_ms = store.race_start_ms + simulated_race_time_seconds * 1000.0
+    race_distance = np.empty(count, dtype=np.float64)
+    observed_ms = np.empty(count, dtype=np.float64)
+    finish_ms = np.full(count, np.inf, dtype=np.float64)
+
+    for i, (times, distances) in enumerate(profiles):
+        race_distance[i] = np.interp(now_ms, times, distances)
+        observed_ms[i] = min(now_ms, times[-1])
+        if now_ms >= times[-1]:
+            finish_ms[i] = times[-1]
+
+    order = np.lexsort((finish_ms, -race_distance))
+    leader = order[0]
+
+    standings: Dict[str, Dict[str, Any]] = {}
+    for position, i in enumerate(order, start=1):
+        gap_to_leader: Optional[float] = 0.0
+        interval: Optional[float] = 0.0
+        car_ahead = None
+        if position > 1:
+            ahead = order[position - 2]
+            car_ahead = driver_codes[ahead]
+            leader_ms = _time_at_race_distance(profiles[leader], race_distance[i])
+            ahead_ms = _time_at_race_distance(profiles[ahead], race_distance[i])
+            gap_to_leader = round(max(0.0, float(observed_ms[i] - leader_ms) / 1000.0), 3) if leader_ms is not None else None
+            interval = round(max(0.0, float(observed_ms[i] - ahead_ms) / 1000.0), 3) if ahead_ms is not None else None
+        standings[driver_codes[i]] = {
+            "race_position": position,
+            "race_distance": round(float(race_distance[i]), 1),
+            "gap_to_leader": gap_to_leader,
+            "interval_to_car_ahead": interval,
+            "car_ahead": car_ahead,
+        }
+    return standings
@@ -0,0 +1,366 @@
+"""
+Tiered rollups of QuantumLeap's doc.etcar table for long-range dashboards.
+
+    etcar (raw ticks) -> etcar_rollup_1s -> etcar_rollup_10s
+                                         -> etcar_rollup_lap
+
+Each tier holds per-car min/max/avg speed and RPM and the DRS-open share per bucket.
+CrateDB has no continuous aggregates, so `refresh_rollups` is run on a schedule: it
+re-aggregates every bucket from slightly before the newest rolled-up one, and upserts
+the result, so partial buckets are completed on the next run. The 10 s and per-lap
+tiers are derived from the 1 s tier with sample-weighted averages.
+
+Raw retention only ever deletes ticks it has just rolled up, and is skipped while a
+writer such as the backfill holds it off with `hold_raw_retention`.
+
+Readers call `select_rollup_tier` with the time range and the number of points the
+panel can show, and get the coarsest tier that still resolves it.
+
+    python -m app.rollups                     # one incremental refresh
+    python -m app.rollups --since 2023-09-03T13:00:00Z --until 2023-09-03T15:00:00Z
+"""
+import argparse
+import datetime
+import logging
+import sys
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.cratedb import ETCAR_TABLE, CrateDBError, execute_sql
+
+
+logger = logging.getLogger(__name__)
+
+RAW_TIER = "raw"
+# Per-lap buckets are irregular; a lap takes under two minutes at every current circuit
+# under green flag, so the lap tier is only picked when two-minute buckets are fine enough.
+LAP_TIER_MAX_BUCKET_SECONDS = 120
+# A car with no 1 s bucket for this long starts a new lap run: the same entity and lap
+# number seen again after a generator restart or another backfill is a separate replay.
+LAP_RUN_GAP_SECONDS = 60
+RETENTION_HOLD_TABLE = '"doc"."etcar_retention_holds"'
+# A hold expires on its own if its holder dies without releasing it.
+RETENTION_HOLD_SECONDS = 900
+
+
+class RollupTier:
+    def __init__(self, name: str, table: str, max_bucket_seconds: float, bucket_interval: Optional[str] = None):
+        self.name = name
+        self.table = table
+        self.max_bucket_seconds = max_bucket_seconds
+        # CrateDB interval literal for fixed-width tiers; None for the per-lap tier.
+        self.bucket_interval = bucket_interval
+
+
+ROLLUP_TIERS = [
+    RollupTier("1s", '"doc"."etcar_rollup_1s"', 1, "1 second"),
+    RollupTier("10s", '"doc"."etcar_rollup_10s"', 10, "10 seconds"),
+    RollupTier("lap", '"doc"."etcar_rollup_lap"', LAP_TIER_MAX_BUCKET_SECONDS),
+]
+ROLLUP_TIERS_BY_NAME = {tier.name: tier for tier in ROLLUP_TIERS}
+
+AGGREGATE_COLUMNS = {
+    "samples": "BIGINT",
+    "speed_min": "REAL",
+    "speed_max": "REAL",
+    "speed_avg": "DOUBLE PRECISION",
+    "rpm_min": "REAL",
+    "rpm_max": "REAL",
+    "rpm_avg": "DOUBLE PRECISION",
+    "drs_share": "DOUBLE PRECISION",
+}
+ROLLUP_COLUMNS = ["entity_id", "drivercode", "simulationsessionkey", "lapnumber", "bucket", "bucket_end"] + list(AGGREGATE_COLUMNS)
+
+# Rolling a finer tier up: counts add, extremes combine, averages are weighted by sample count.
+_COMBINE_AGGREGATES = """
+    sum(samples), min(speed_min), max(speed_max), sum(speed_avg * samples) / sum(samples),
+    min(rpm_min), max(rpm_max), sum(rpm_avg * samples) / sum(samples), sum(drs_share * samples) / sum(samples)
+"""
+
+
+def _primary_key(tier: RollupTier) -> List[str]:
+    # A lap is keyed by its first second too, so replays of the same session keep their own rows.
+    return ["entity_id", "bucket"] if tier.bucket_interval else ["entity_id", "lapnumber", "bucket"]
+
+
+def _table_ddl(tier: RollupTier) -> str:
+    columns = ", ".join(
+        [
+            '"entity_id" TEXT NOT NULL',
+            '"drivercode" TEXT',
+            '"simulationsessionkey" REAL',
+            f'"lapnumber" REAL{" NOT NULL" if not tier.bucket_interval else ""}',
+            '"bucket" TIMESTAMP WITH TIME ZONE NOT NULL',
+            '"bucket_end" TIMESTAMP WITH TIME ZONE',
+        ]
+        + [f'"{name}" {column_type}' for name, column_type in AGGREGATE_COLUMNS.items()]
+    )
+    return f"CREATE TABLE IF NOT EXISTS {tier.table} ({columns}, PRIMARY KEY ({', '.join(_primary_key(tier))}))"
+
+
+def ensure_rollup_tables(crate_url: str):
+    for tier in ROLLUP_TIERS:
+        execute_sql(crate_url, _table_ddl(tier))
+    execute_sql(
+        crate_url,
+        f'CREATE TABLE IF NOT EXISTS {RETENTION_HOLD_TABLE} ("holder" TEXT PRIMARY KEY, "expires_at" TIMESTAMP WITH TIME ZONE NOT NULL)'
+    )
+
+
+def _epoch_ms(moment: datetime.datetime) -> int:
+    return int(moment.timestamp() * 1000)
+
+
+def _range_filter(column: str, since_ms: Optional[int], until_ms: Optional[int]) -> Tuple[str, List[Any]]:
+    clauses, args = [], []
+    if since_ms is not None:
+        clauses.append(f"{column} >= ?")
+        args.append(since_ms)
+    if until_ms is not None:
+        clauses.append(f"{column} < ?")
+        args.append(until_ms)
+    return (" AND ".join(clauses) or "TRUE"), args
+
+
+def _insert_prefix(tier: RollupTier) -> str:
+    return f"INSERT INTO {tier.table} ({', '.join(ROLLUP_COLUMNS)}) "
+
+
+def _upsert_suffix(tier: RollupTier) -> str:
+    key = _primary_key(tier)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in ROLLUP_COLUMNS if column not in key)
+    return f" ON CONFLICT ({', '.join(key)}) DO UPDATE SET {updates}"
+
+
+def _refresh_1s(crate_url: str, since_ms: Optional[int], until_ms: Optional[int]) -> int:
+    tier = ROLLUP_TIERS_BY_NAME["1s"]
+    bucket = f"date_bin(INTERVAL '{tier.bucket_interval}', time_index, 0)"
+    where, args = _range_filter("time_index", since_ms, until_ms)
+    stmt = _insert_prefix(tier) + f"""
+        SELECT entity_id, max(drivercode), max(simulationsessionkey), max(lapnumber),
+                {bucket}, {bucket} + INTERVAL '{tier.bucket_interval}',
+                count(*), min(speed), max(speed), avg(speed), min(rpm), max(rpm), avg(rpm),
+                avg(CASE WHEN drs THEN 1.0 ELSE 0.0 END)
+         FROM {ETCAR_TABLE}
+         WHERE {where} AND time_index IS NOT NULL
+         GROUP BY entity_id, {bucket}""" + _upsert_suffix(tier)
+    return execute_sql(crate_url, stmt, args).get("rowcount", 0)
+
+
+def _refresh_10s(crate_url: str, since_ms: Optional[int], until_ms: Optional[int]) -> int:
+    source, tier = ROLLUP_TIERS_BY_NAME["1s"], ROLLUP_TIERS_BY_NAME["10s"]
+    bucket = f"date_bin(INTERVAL '{tier.bucket_interval}', bucket, 0)"
+    # Start and end on 10 s boundaries so every bucket touched is rebuilt from all of its seconds.
+    bucket_ms = tier.max_bucket_seconds * 1000
+    since_ms = since_ms - since_ms % bucket_ms if since_ms is not None else None
+    until_ms = until_ms - until_ms % bucket_ms + (bucket_ms if until_ms % bucket_ms else 0) if until_ms is not None else None
+    where, args = _range_filter("bucket", since_ms, until_ms)
+    stmt = _insert_prefix(tier) + f"""
+        SELECT entity_id, max(drivercode), max(simulationsessionkey), max(lapnumber),
+                {bucket}, {bucket} + INTERVAL '{tier.bucket_interval}', {_COMBINE_AGGREGATES}
+         FROM {source.table}
+         WHERE {where}
+         GROUP BY entity_id, {bucket}""" + _upsert_suffix(tier)
+    return execute_sql(crate_url, stmt, args).get("rowcount", 0)
+
+
+def _refresh_lap(crate_url: str, since_ms: Optional[int], until_ms: Optional[int], lap_lookback_seconds: float) -> int:
+    """
+    Rebuilds the laps with seconds in [since, until), reading back and ahead far enough
+    to cover their start and end, so a lap across either bound is never truncated.
+
+    Replays of a session reuse entity ids and lap numbers, so each car's 1 s buckets are
+    first cut into runs: a new run starts whenever the lap number changes or the car has
+    no bucket for LAP_RUN_GAP_SECONDS. Each run is one row, keyed by its first second.
+    """
+    source, tier = ROLLUP_TIERS_BY_NAME["1s"], ROLLUP_TIERS_BY_NAME["lap"]
+    lookback_ms = since_ms - int(lap_lookback_seconds * 1000) if since_ms is not None else None
+    lookahead_ms = until_ms + int(lap_lookback_seconds * 1000) if until_ms is not None else None
+    where, args = _range_filter("bucket", lookback_ms, lookahead_ms)
+    having_clauses, having_args = [], []
+    if since_ms is not None:
+        having_clauses.append("max(bucket) >= ?")
+        having_args.append(since_ms)
+    if until_ms is not None:
+        having_clauses.append("min(bucket) < ?")
+        having_args.append(until_ms)
+    having = " AND ".join(having_clauses) or "TRUE"
+    columns = ", ".join(ROLLUP_COLUMNS)
+    stmt = _insert_prefix(tier) + f"""
+        SELECT entity_id, max(drivercode), max(simulationsessionkey), lapnumber,
+                min(bucket), max(bucket_end), {_COMBINE_AGGREGATES}
+         FROM (SELECT {columns}, sum(run_start) OVER (PARTITION BY entity_id ORDER BY bucket) AS run
+               FROM (SELECT {columns},
+                            CASE WHEN previous_lapnumber IS NULL OR previous_lapnumber <> lapnumber
+                                   OR CAST(bucket AS BIGINT) - CAST(previous_bucket AS BIGINT) > ?
+                                 THEN 1 ELSE 0 END AS run_start
+                     FROM (SELECT {columns},
+                                  lag(lapnumber) OVER (PARTITION BY entity_id ORDER BY bucket) AS previous_lapnumber,
+                                  lag(bucket) OVER (PARTITION BY entity_id ORDER BY bucket) AS previous_bucket
+                           FROM {source.table}
+                           WHERE {where} AND lapnumber IS NOT NULL) AS seconds) AS flagged) AS runs
+         GROUP BY entity_id, lapnumber, run
+         HAVING {having}""" + _upsert_suffix(tier)
+    return execute_sql(crate_url, stmt, [LAP_RUN_GAP_SECONDS * 1000] + args + having_args).get("rowcount", 0)
+
+
+def rollup_watermark(crate_url: str) -> Optional[datetime.datetime]:
+    """Start of the newest 1 s bucket, or None before the first refresh."""
+    rows = execute_sql(crate_url, f"SELECT max(bucket) FROM {ROLLUP_TIERS_BY_NAME['1s'].table}").get("rows") or [[None]]
+    if rows[0][0] is None:
+        return None
+    return datetime.datetime.fromtimestamp(rows[0][0] / 1000.0, tz=datetime.timezone.utc)
+
+
+def refresh_rollups(
+    crate_url: str,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    late_seconds: float = 30,
+    lap_lookback_seconds: float = 900
+) -> Dict[str, Any]:
+    """
+    Re-aggregates every tier over [since, until). Without `since`, continues from the
+    newest 1 s bucket minus `late_seconds`, so ticks that arrived late are folded in;
+    on an empty rollup table that is a full rebuild.
+    """
+    if since is None:
+        watermark = rollup_watermark(crate_url)
+        since = watermark - datetime.timedelta(seconds=late_seconds) if watermark is not None else None
+    since_ms = _epoch_ms(since) - _epoch_ms(since) % 1000 if since is not None else None
+    until_ms = _epoch_ms(until) if until is not None else None
+
+    # The 1 s tier must be complete before the coarser tiers read it.
+    rows = {"1s": _refresh_1s(crate_url, since_ms, until_ms)}
+    execute_sql(crate_url, f"REFRESH TABLE {ROLLUP_TIERS_BY_NAME['1s'].table}")
+    rows["10s"] = _refresh_10s(crate_url, since_ms, until_ms)
+    rows["lap"] = _refresh_lap(crate_url, since_ms, until_ms, lap_lookback_seconds)
+    logger.info(f"Rolled up etcar since {since.isoformat() if since else 'the beginning'}: {rows}")
+    return {"since": since, "until": until, "rows": rows}
+
+
+def hold_raw_retention(crate_url: str, holder: str, hold_seconds: float = RETENTION_HOLD_SECONDS):
+    """Takes or renews a hold that keeps raw retention off for `hold_seconds`, e.g. while history is being written."""
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=hold_seconds)
+    execute_sql(
+        crate_url,
+        f"INSERT INTO {RETENTION_HOLD_TABLE} (holder, expires_at) VALUES (?, ?) ON CONFLICT (holder) DO UPDATE SET expires_at = excluded.expires_at",
+        [holder, _epoch_ms(expires_at)]
+    )
+    execute_sql(crate_url, f"REFRESH TABLE {RETENTION_HOLD_TABLE}")
+
+
+def release_raw_retention(crate_url: str, holder: str):
+    execute_sql(crate_url, f"DELETE FROM {RETENTION_HOLD_TABLE} WHERE holder = ?", [holder])
+
+
+def raw_retention_holders(crate_url: str) -> List[str]:
+    """Holders of unexpired retention holds."""
+    rows = execute_sql(
+        crate_url,
+        f"SELECT holder FROM {RETENTION_HOLD_TABLE} WHERE expires_at > ?",
+        [_epoch_ms(datetime.datetime.now(datetime.timezone.utc))]
+    ).get("rows", [])
+    return [row[0] for row in rows]
+
+
+def apply_raw_retention(crate_url: str, retention_hours: float, late_seconds: float = 30, lap_lookback_seconds: float = 900) -> int:
+    """
+    Deletes raw ticks older than `retention_hours`. Retention is on time_index, so it
+    reaches backfilled history too, which may sit below the rollup watermark without
+    having been rolled up; the range about to be deleted is therefore rolled up first.
+    Skipped while a retention hold is active. Returns the rows deleted.
+    """
+    if retention_hours <= 0:
+        return 0
+    holders = raw_retention_holders(crate_url)
+    if holders:
+        logger.info(f"Raw retention held by {holders}; not deleting.")
+        return 0
+
+    cutoff_ms = _epoch_ms(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=retention_hours))
+    cutoff_ms -= cutoff_ms % 1000
+    rows = execute_sql(crate_url, f"SELECT min(time_index) FROM {ETCAR_TABLE} WHERE time_index < ?", [cutoff_ms]).get("rows") or [[None]]
+    if rows[0][0] is None:
+        return 0
+    refresh_rollups(
+        crate_url,
+        since=datetime.datetime.fromtimestamp(rows[0][0] / 1000.0, tz=datetime.timezone.utc),
+        until=datetime.datetime.fromtimestamp(cutoff_ms / 1000.0, tz=datetime.timezone.utc),
+        late_seconds=late_seconds,
+        lap_lookback_seconds=lap_lookback_seconds
+    )
+    deleted = execute_sql(crate_url, f"DELETE FROM {ETCAR_TABLE} WHERE time_index < ?", [cutoff_ms]).get("rowcount", 0)
+    if deleted:
+        logger.info(f"Raw retention: rolled up and deleted {deleted} etcar rows older than {datetime.datetime.fromtimestamp(cutoff_ms / 1000.0, tz=datetime.timezone.utc).isoformat()}")
+    return deleted
+
+
+def maintain_rollups(crate_url: str, late_seconds: float, lap_lookback_seconds: float, raw_retention_hours: float) -> Dict[str, Any]:
+    """One scheduled pass: incremental refresh of every tier, then raw retention."""
+    try:
+        result = refresh_rollups(crate_url, late_seconds=late_seconds, lap_lookback_seconds=lap_lookback_seconds)
+    except CrateDBError as e:
+        if "RelationUnknown" in str(e):
+            logger.info("etcar does not exist yet; nothing to roll up.")
+            return {"rows": {}}
+        raise
+    result["raw_deleted"] = apply_raw_retention(crate_url, raw_retention_hours, late_seconds, lap_lookback_seconds)
+    return result
+
+
+def select_rollup_tier(range_seconds: float, max_points: int) -> str:
+    """
+    Coarsest tier whose buckets are no wider than `range_seconds / max_points`, i.e. the
+    fewest rows that still give the panel one point per pixel column. Falls back to raw.
+    """
+    resolution_seconds = range_seconds / max(1, max_points)
+    selected = RAW_TIER
+    for tier in ROLLUP_TIERS:
+        if tier.max_bucket_seconds <= resolution_seconds:
+            selected = tier.name
+    return selected
+
+
+def query_series(crate_url: str, entity_id: str, start: datetime.datetime, end: datetime.datetime, max_points: int) -> Dict[str, Any]:
+    """Speed/RPM/DRS series of one car over [start, end] from the coarsest tier that resolves it."""
+    tier_name = select_rollup_tier((end - start).total_seconds(), max_points)
+    args = [entity_id, _epoch_ms(start), _epoch_ms(end)]
+    if tier_name == RAW_TIER:
+        stmt = (
+            f"SELECT time_index, 1, speed, speed, speed, rpm, rpm, rpm, CASE WHEN drs THEN 1.0 ELSE 0.0 END "
+            f"FROM {ETCAR_TABLE} WHERE entity_id = ? AND time_index BETWEEN ? AND ? ORDER BY time_index"
+        )
+    else:
+        stmt = (
+            f"SELECT bucket, {', '.join(AGGREGATE_COLUMNS)} "
+            f"FROM {ROLLUP_TIERS_BY_NAME[tier_name].table} WHERE entity_id = ? AND bucket BETWEEN ? AND ? ORDER BY bucket"
+        )
+    rows = execute_sql(crate_url, stmt, args).get("rows", [])
+    columns = ["time"] + list(AGGREGATE_COLUMNS)
+    return {
+        "tier": tier_name,
+        "row_count": len(rows),
+        "columns": {name: [row[i] for row in rows] for i, name in enumerate(columns)},
+    }
+
+
+def _parse_timestamp(value: str) -> datetime.datetime:
+    moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.replace(tzinfo=datetime.timezone.utc)
+
+
+def run(argv: Optional[List[str]] = None) -> int:
+    from app import main as service
+
+    parser = argparse.ArgumentParser(description="Refresh the etcar rollup tiers.")
+    parser.add_argument("--since", type=_parse_timestamp, default=None, help="ISO-8601 start (default: continue from the newest rollup)")
+    parser.add_argument("--until", type=_parse_timestamp, default=None, help="ISO-8601 end (default: open-ended)")
+    args = parser.parse_args(argv)
+
+    ensure_rollup_tables(service.CRATE_URL)
+    refresh_rollups(service.CRATE_URL, args.since, args.until, service.ROLLUP_LATE_SECONDS, service.ROLLUP_LAP_LOOKBACK_SECONDS)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.telemetry_store import DriverTelemetry, SessionTelemetryStore
+from app.track_index import TrackIndex
+
+
+logger = logging.getLogger(__name__)
+
+STORE_FORMAT_VERSION = 1
+CURRENT_POINTER_FILE = "CURRENT"
+META_FILE = "meta.json"
+TRACK_INDEX_PREFIX = "track"
+RACE_DISTANCE_PROFILE_ARRAYS = ("profile_session_ms", "profile_race_distance")
+
+
+def session_store_directory(root_path: str, year: int, gp: str, session_identifier: str) -> str:
+    """Directory holding the published versions of one session's store under `root_path`."""
+    key = re.sub(r"[^A-Za-z0-9]+", "_", f"{year}_{gp}_{session_identifier}").strip("_")
+    return os.path.join(root_path, key)
+
+
+def publish_session_store(store: SessionTelemetryStore, directory: str, simulation_origin_epoch: float) -> str:
+    """
+    Writes every driver array of `store` as an .npy file into a new version directory and
+    atomically points CURRENT at it. Readers map the files instead of copying them, so N
+    processes share one copy through the page cache. Returns the published version.
+    """
+    version = f"v{int(time.time() * 1000)}-{os.getpid()}"
+    version_directory = os.path.join(directory, version)
+    os.makedirs(version_directory)
+
+    drivers = {}
+    profile_drivers = []
+    for driver_code, driver_telemetry in store.drivers.items():
+        arrays = driver_telemetry.to_arrays()
+        for name, values in arrays.items():
+            np.save(os.path.join(version_directory, f"{driver_code}.{name}.npy"), values)
+        drivers[driver_code] = list(arrays)
+        profile = store.race_distance_profile(driver_code)
+        if profile is not None:
+            for name, values in zip(RACE_DISTANCE_PROFILE_ARRAYS, profile):
+                np.save(os.path.join(version_directory, f"{driver_code}.{name}.npy"), values)
+            profile_drivers.append(driver_code)
+
+    track_index_arrays = None
+    if store.track_index is not None:
+        track_index_arrays = store.track_index.to_arrays()
+        for name, values in track_index_arrays.items():
+            np.save(os.path.join(version_directory, f"{TRACK_INDEX_PREFIX}.{name}.npy"), values)
+
+    meta = {
+        "format_version": STORE_FORMAT_VERSION,
+        "year": store.year,
+        "event_name": store.event_name,
+        "session": store.session_identifier,
+        "source_nbytes": store.source_nbytes,
+        "session_t0_epoch": store.session_t0_epoch,
+        "simulation_origin_epoch": simulation_origin_epoch,
+        "published_at_epoch": time.time(),
+        "drivers": drivers,
+        "race_distance_profiles": profile_drivers,
+        "track_index": list(track_index_arrays) if track_index_arrays is not None else None,
+    }
+    with open(os.path.join(version_directory, META_FILE), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    pointer_tmp = os.path.join(directory, f".{CURRENT_POINTER_FILE}.{os.getpid()}")
+    with open(pointer_tmp, "w") as pointer_file:
+        pointer_file.write(version)
+    os.replace(pointer_tmp, os.path.join(directory, CURRENT_POINTER_FILE))
+
+    _remove_stale_versions(directory, keep_latest=2)
+    logger.info(f"Published telemetry store version {version} ({store.nbytes / 2**20:.1f} MiB, {len(drivers)} drivers) to {directory}")
+    return version
+
+
+def _remove_stale_versions(directory: str, keep_latest: int):
+    # Keep the previous version too, so readers that just resolved CURRENT can still open it.
+    versions = sorted(
+        (entry for entry in os.listdir(directory) if entry.startswith("v") and os.path.isdir(os.path.join(directory, entry))),
+        key=lambda entry: os.path.getmtime(os.path.join(directory, entry))
+    )
+    for stale in versions[:-keep_latest]:
+        shutil.rmtree(os.path.join(directory, stale), ignore_errors=True)
+        logger.debug(f"Removed stale telemetry store version {stale}")
+
+
+def read_published_version(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, CURRENT_POINTER_FILE)) as pointer_file:
+            return pointer_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_session_store(directory: str, version: str) -> Tuple[SessionTelemetryStore, Dict[str, Any]]:
+    """Maps a published store version read-only. Returns the store and its metadata."""
+    version_directory = os.path.join(directory, version)
+    with open(os.path.join(version_directory, META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get("format_version") != STORE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported telemetry store format {meta.get('format_version')} in {version_directory}")
+
+    drivers = {}
+    race_distance_profiles = {}
+    for driver_code, names in meta["drivers"].items():
+        arrays = {name: np.load(os.path.join(version_directory, f"{driver_code}.{name}.npy"), mmap_mode="r") for name in names}
+        drivers[driver_code] = DriverTelemetry.from_arrays(driver_code, arrays)
+        if driver_code in meta.get("race_distance_profiles", []):
+            race_distance_profiles[driver_code] = tuple(
+                np.load(os.path.join(version_directory, f"{driver_code}.{name}.npy"), mmap_mode="r") for name in RACE_DISTANCE_PROFILE_ARRAYS
+            )
+
+    track_index = None
+    if meta.get("track_index"):
+        track_index = TrackIndex.from_arrays({
+            name: np.load(os.path.join(version_directory, f"{TRACK_INDEX_PREFIX}.{name}.npy"), mmap_mode="r")
+            for name in meta["track_index"]
+        })
+
+    store = SessionTelemetryStore(meta["year"], meta["event_name"], meta["session"], drivers, meta["source_nbytes"], meta.get("session_t0_epoch"), track_index, race_distance_profiles)
+    return store, meta
@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Records how long each startup phase takes, measured from the moment the timer is
+    created (the first line of the entry point). Phases triggered lazily on first use,
+    such as importing FastF1 or loading a session, are recorded whenever they happen.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.origin_epoch = time.time()
+        self._last_mark = self.origin
+        self._phases: List[Tuple[str, float, float]] = []
+        self._lock = threading.Lock()
+        self.ready_at = None
+
+    def _record(self, name: str, started: float, finished: float):
+        with self._lock:
+            self._phases.append((name, finished - started, finished - self.origin))
+        logger.debug(f"Startup phase '{name}' took {(finished - started) * 1000:.1f} ms")
+
+    def mark(self, name: str):
+        """Records a phase that spans from the previous mark (or timer creation) until now."""
+        now = time.perf_counter()
+        started, self._last_mark = self._last_mark, now
+        self._record(name, started, now)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Records the duration of the wrapped block as a phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, started, time.perf_counter())
+
+    def mark_ready(self):
+        self.ready_at = time.perf_counter() - self.origin
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = list(self._phases)
+        return {
+            "ready_after_ms": round(self.ready_at * 1000, 1) if self.ready_at is not None else None,
+            "phases": [
+                {"phase": name, "duration_ms": round(duration * 1000, 1), "finished_at_ms": round(finished_at * 1000, 1)}
+                for name, duration, finished_at in phases
+            ]
+        }
+
+    def log_report(self):
+        report = self.report()
+        summary = ", ".join(f"{phase['phase']}={phase['duration_ms']}ms" for phase in report["phases"])
+        logger.info(f"Startup report: ready after {report['ready_after_ms']} ms ({summary})")
@@ -0,0 +1,481 @@
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.track_index import TrackIndex, DEFAULT_MINI_SECTOR_COUNT, build_track_index
+
+
+logger = logging.getLogger(__name__)
+
+# Only the channels the generator reads are kept, each in the smallest dtype that holds it.
+CHANNEL_DTYPES = {
+    "Speed": np.float32,
+    "RPM": np.uint16,
+    "nGear": np.int8,
+    "Throttle": np.uint8,
+    "Brake": np.bool_,
+    "DRS": np.bool_,
+    "Distance": np.float32,
+    "X": np.float32,
+    "Y": np.float32,
+}
+TELEMETRY_CHANNELS = list(CHANNEL_DTYPES)
+
+SAMPLE_STATUS_DATA_FOUND = 0
+SAMPLE_STATUS_BEFORE_START = 1
+SAMPLE_STATUS_AFTER_FINISH = 2
+SAMPLE_STATUS_INTERPOLATED = 3
+
+SAMPLE_STATUS_MESSAGES = {
+    SAMPLE_STATUS_DATA_FOUND: "Data found",
+    SAMPLE_STATUS_BEFORE_START: "Simulation at historical race start (Lap 1, Time 0).",
+    SAMPLE_STATUS_AFTER_FINISH: "Simulated time is after the historical race finish.",
+    SAMPLE_STATUS_INTERPOLATED: "No timed lap at this time; position interpolated along the track.",
+}
+
+
+def _batch_to_point(batch: Dict[str, np.ndarray], driver_code: str) -> Dict[str, Any]:
+    point = {key: values[0].item() for key, values in batch.items()}
+    point["status"] = SAMPLE_STATUS_MESSAGES[point["status"]]
+    point["driver_code"] = driver_code
+    return point
+
+
+class DriverTelemetry:
+    """
+    One driver's timed laps and merged car/position telemetry held as flat numpy arrays.
+
+    Samples are sorted by session time and grouped per lap: the rows of lap `i` are
+    `lap_offsets[i]:lap_offsets[i + 1]`, so a whole batch of simulated times can be
+    resolved with `np.searchsorted` instead of one DataFrame scan per point.
+    All timestamps are int32 milliseconds of session time.
+    """
+
+    def __init__(
+        self,
+        driver_code: str,
+        lap_numbers: np.ndarray,
+        lap_start_ms: np.ndarray,
+        lap_end_ms: np.ndarray,
+        lap_offsets: np.ndarray,
+        session_ms: np.ndarray,
+        channels: Dict[str, np.ndarray],
+    ):
+        self.driver_code = driver_code
+        self.lap_numbers = lap_numbers
+        self.lap_start_ms = lap_start_ms
+        self.lap_end_ms = lap_end_ms
+        self.lap_offsets = lap_offsets
+        self.session_ms = session_ms
+        self.channels = channels
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Flattens the driver's data into named arrays, e.g. for writing to shared files."""
+        arrays = {
+            "lap_numbers": self.lap_numbers,
+            "lap_start_ms": self.lap_start_ms,
+            "lap_end_ms": self.lap_end_ms,
+            "lap_offsets": self.lap_offsets,
+            "session_ms": self.session_ms,
+        }
+        arrays.update({f"channel_{name}": values for name, values in self.channels.items()})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, driver_code: str, arrays: Dict[str, np.ndarray]) -> "DriverTelemetry":
+        """Inverse of `to_arrays`; the arrays are used as-is, so memory-mapped arrays stay mapped."""
+        channels = {name[len("channel_"):]: values for name, values in arrays.items() if name.startswith("channel_")}
+        return cls(
+            driver_code=driver_code,
+            lap_numbers=arrays["lap_numbers"],
+            lap_start_ms=arrays["lap_start_ms"],
+            lap_end_ms=arrays["lap_end_ms"],
+            lap_offsets=arrays["lap_offsets"],
+            session_ms=arrays["session_ms"],
+            channels=channels,
+        )
+
+    @property
+    def sample_count(self) -> int:
+        return int(self.session_ms.shape[0])
+
+    @property
+    def lap_count(self) -> int:
+        return int(self.lap_numbers.shape[0])
+
+    def array_nbytes(self) -> Dict[str, int]:
+        sizes = {
+            "lap_numbers": self.lap_numbers.nbytes,
+            "lap_start_ms": self.lap_start_ms.nbytes,
+            "lap_end_ms": self.lap_end_ms.nbytes,
+            "lap_offsets": self.lap_offsets.nbytes,
+            "session_ms": self.session_ms.nbytes,
+        }
+        sizes.update({name: values.nbytes for name, values in self.channels.items()})
+        return sizes
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.array_nbytes().values())
+
+    def sample(self, simulated_race_times: np.ndarray, origin_ms: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Resolves many simulated race times (seconds since t=0) in one vectorized pass.
+
+        t=0 is session time `origin_ms`; without it, the start of the driver's first timed
+        lap, as in `get_telemetry_at_simulated_time`. Times outside the driver's timed laps
+        are clamped to its start/finish, and each point takes the telemetry row closest in
+        time within the mapped lap. `SessionTelemetryStore.sample` puts every car on the
+        same clock and fills laps without telemetry.
+        """
+        simulated = np.asarray(simulated_race_times, dtype=np.float64)
+        lap_start = self.lap_start_ms.astype(np.float64)
+        lap_end = self.lap_end_ms.astype(np.float64)
+        first_start = lap_start[0]
+        last_end = lap_end[-1]
+
+        historical = (first_start if origin_ms is None else origin_ms) + simulated * 1000.0
+        status = np.full(simulated.shape, SAMPLE_STATUS_DATA_FOUND, dtype=np.uint8)
+        status[historical < first_start] = SAMPLE_STATUS_BEFORE_START
+        status[historical >= last_end] = SAMPLE_STATUS_AFTER_FINISH
+        historical = np.clip(historical, first_start, max(lap_start[-1], last_end - 1.0))
+
+        lap_idx = np.searchsorted(lap_start, historical, side="right") - 1
+        lap_idx = np.clip(lap_idx, 0, self.lap_count - 1)
+        lap_duration = lap_end[lap_idx] - lap_start[lap_idx]
+        time_within_lap = np.clip(historical - lap_start[lap_idx], 0.0, lap_duration)
+        target = lap_start[lap_idx] + time_within_lap
+
+        lo = self.lap_offsets[lap_idx]
+        hi = self.lap_offsets[lap_idx + 1] - 1
+        after = np.clip(np.searchsorted(self.session_ms, target, side="left"), lo, hi)
+        before = np.clip(after - 1, lo, hi)
+        take_before = np.abs(self.session_ms[before] - target) <= np.abs(self.session_ms[after] - target)
+        row = np.where(take_before, before, after)
+
+        channels = self.channels
+        return {
+            "status": status,
+            "simulated_elapsed_race_time_seconds": np.round(simulated, 3),
+            "target_lap_number": self.lap_numbers[lap_idx].astype(np.int64),
+            "calculated_time_within_lap_seconds": np.round(time_within_lap / 1000.0, 3),
+            "closest_actual_second_in_lap": np.round((self.session_ms[row] - lap_start[lap_idx]) / 1000.0, 3),
+            "distance": np.round(channels["Distance"][row].astype(np.float64), 1),
+            "speed": np.round(channels["Speed"][row].astype(np.float64), 1),
+            "drs": channels["DRS"][row],
+            "gear": channels["nGear"][row].astype(np.int64),
+            "rpm": channels["RPM"][row].astype(np.int64),
+            "brake": channels["Brake"][row].astype(np.int64),
+            "throttle": channels["Throttle"][row].astype(np.int64),
+            "x": np.round(channels["X"][row].astype(np.float64), 2),
+            "y": np.round(channels["Y"][row].astype(np.float64), 2),
+        }
+
+    def sample_one(self, simulated_race_time_seconds: float) -> Dict[str, Any]:
+        """Single-point convenience wrapper returning plain Python values."""
+        return _batch_to_point(self.sample(np.array([simulated_race_time_seconds])), self.driver_code)
+
+
+class SessionTelemetryStore:
+    """Compact telemetry of every driver in one session, replacing the FastF1 session object once built."""
+
+    def __init__(
+        self,
+        year: int,
+        event_name: str,
+        session_identifier: str,
+        drivers: Dict[str, DriverTelemetry],
+        source_nbytes: int,
+        session_t0_epoch: Optional[float] = None,
+        track_index: Optional[TrackIndex] = None,
+        race_distance_profiles: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+    ):
+        self.year = year
+        self.event_name = event_name
+        self.session_identifier = session_identifier
+        self.drivers = drivers
+        self.source_nbytes = source_nbytes
+        # Wall-clock time (unix epoch s) of session time 0, when FastF1 knows it.
+        self.session_t0_epoch = session_t0_epoch
+        self.track_index = track_index
+        self._track_length_m: Optional[float] = None
+        self._race_start_ms: Optional[float] = None
+        # Published with the store arrays, so API workers map them instead of each building a copy.
+        self._race_distance_profiles: Dict[str, Tuple[np.ndarray, np.ndarray]] = dict(race_distance_profiles or {})
+
+    def get(self, driver_code: str) -> Optional[DriverTelemetry]:
+        return self.drivers.get(driver_code)
+
+    @property
+    def track_length_m(self) -> Optional[float]:
+        """Median distance covered per timed lap across all drivers, computed once on first use."""
+        if self._track_length_m is None and self.drivers:
+            lap_lengths = [
+                driver_telemetry.channels["Distance"][driver_telemetry.lap_offsets[1:] - 1]
+                for driver_telemetry in self.drivers.values()
+            ]
+            self._track_length_m = float(np.median(np.concatenate(lap_lengths)))
+        return self._track_length_m
+
+    @property
+    def race_start_ms(self) -> Optional[float]:
+        """Earliest first-lap start across the grid: t=0 of the session clock every car is sampled on."""
+        if self._race_start_ms is None and self.drivers:
+            self._race_start_ms = float(min(int(driver_telemetry.lap_start_ms[0]) for driver_telemetry in self.drivers.values()))
+        return self._race_start_ms
+
+    def race_distance_profile(self, driver_code: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Session time (ms) and race distance (m) of every telemetry sample of a driver, race
+        distance being (lap - 1) * track length + distance into the lap, made non-decreasing.
+        The profile is anchored at 0 m at race start and at the full distance at the end of
+        the last timed lap, so laps missing from the store (e.g. without a LapTime) are
+        bridged by interpolating between the samples around them. Computed once per driver,
+        or mapped from the shared store; float64 so `np.interp` reads it without a copy.
+        """
+        profile = self._race_distance_profiles.get(driver_code)
+        if profile is not None:
+            return profile
+        driver_telemetry = self.drivers.get(driver_code)
+        track_length_m = self.track_length_m
+        if driver_telemetry is None or not track_length_m:
+            return None
+
+        sample_lap = np.repeat(driver_telemetry.lap_numbers.astype(np.float64), np.diff(driver_telemetry.lap_offsets))
+        distance_in_lap = np.minimum(driver_telemetry.channels["Distance"].astype(np.float64), track_length_m)
+        distances = np.maximum.accumulate(np.maximum((sample_lap - 1.0) * track_length_m + distance_in_lap, 0.0))
+        times = driver_telemetry.session_ms.astype(np.float64)
+
+        race_start_ms = self.race_start_ms
+        if times[0] > race_start_ms:
+            times = np.concatenate(([race_start_ms], times))
+            distances = np.concatenate(([0.0], distances))
+        finish_ms = float(driver_telemetry.lap_end_ms[-1])
+        if finish_ms > times[-1]:
+            times = np.append(times, finish_ms)
+            distances = np.append(distances, max(float(driver_telemetry.lap_numbers[-1]) * track_length_m, distances[-1]))
+
+        profile = (times, distances)
+        self._race_distance_profiles[driver_code] = profile
+        return profile
+
+    @property
+    def driver_codes(self) -> List[str]:
+        return list(self.drivers)
+
+    def sample(self, driver_code: str, simulated_race_times: np.ndarray) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Samples one driver on the session clock shared by every car: t=0 is `race_start_ms`.
+
+        Times that fall in a lap the store has no telemetry for (no LapTime, e.g. lap 1)
+        are filled from the race distance profile, so lap and distance agree with
+        `compute_running_order`: X/Y is placed on the track index centreline, speed is the
+        average over the gap and the other channels keep the nearest timed row.
+        """
+        driver_telemetry = self.drivers.get(driver_code)
+        if driver_telemetry is None:
+            return None
+        simulated = np.asarray(simulated_race_times, dtype=np.float64)
+        race_start_ms = self.race_start_ms
+        columns = driver_telemetry.sample(simulated, origin_ms=race_start_ms)
+        profile = self.race_distance_profile(driver_code)
+        if profile is None:
+            return columns
+
+        times, distances = profile
+        track_length_m = self.track_length_m
+        now_ms = race_start_ms + simulated * 1000.0
+        race_distance = np.interp(now_ms, times, distances)
+        lap_number = np.floor(race_distance / track_length_m).astype(np.int64) + 1
+        fill = (
+            (now_ms >= race_start_ms)
+            & (columns["status"] != SAMPLE_STATUS_AFTER_FINISH)
+            & ~np.isin(lap_number, driver_telemetry.lap_numbers)
+        )
+        if not fill.any():
+            return columns
+
+        lap_number, race_distance, now_ms = lap_number[fill], race_distance[fill], now_ms[fill]
+        distance_in_lap = race_distance - (lap_number - 1) * track_length_m
+        time_within_lap = np.round((now_ms - np.interp((lap_number - 1) * track_length_m, distances, times)) / 1000.0, 3)
+        metres_per_second = np.interp(now_ms + 500.0, times, distances) - np.interp(now_ms - 500.0, times, distances)
+        columns["status"][fill] = SAMPLE_STATUS_INTERPOLATED
+        columns["target_lap_number"][fill] = lap_number
+        columns["calculated_time_within_lap_seconds"][fill] = time_within_lap
+        columns["closest_actual_second_in_lap"][fill] = time_within_lap
+        columns["distance"][fill] = np.round(distance_in_lap, 1)
+        columns["speed"][fill] = np.round(metres_per_second * 3.6, 1)
+        if self.track_index is not None:
+            x, y = self.track_index.position_at(distance_in_lap / track_length_m * self.track_index.length_m)
+            columns["x"][fill] = np.round(x, 2)
+            columns["y"][fill] = np.round(y, 2)
+        return columns
+
+    def sample_point(self, driver_code: str, simulated_race_time_seconds: float) -> Optional[Dict[str, Any]]:
+        """Samples one driver at one simulated time, with the session context `format_to_ngsi_v2` expects."""
+        batch = self.sample(driver_code, np.array([simulated_race_time_seconds]))
+        if batch is None:
+            return None
+        point = _batch_to_point(batch, driver_code)
+        point["year"] = self.year
+        point["gp"] = self.event_name
+        point["session"] = self.session_identifier
+        return point
+
+    @property
+    def nbytes(self) -> int:
+        return sum(driver_telemetry.nbytes for driver_telemetry in self.drivers.values())
+
+    def memory_report(self) -> Dict[str, Any]:
+        compact_nbytes = self.nbytes
+        channel_nbytes: Dict[str, int] = {}
+        for driver_telemetry in self.drivers.values():
+            for name, size in driver_telemetry.array_nbytes().items():
+                channel_nbytes[name] = channel_nbytes.get(name, 0) + size
+        return {
+            "year": self.year,
+            "gp": self.event_name,
+            "session": self.session_identifier,
+            "driver_count": len(self.drivers),
+            "sample_count": sum(driver_telemetry.sample_count for driver_telemetry in self.drivers.values()),
+            "source_session_bytes": self.source_nbytes,
+            "compact_store_bytes": compact_nbytes,
+            "saved_bytes": self.source_nbytes - compact_nbytes,
+            "compression_ratio": round(self.source_nbytes / compact_nbytes, 1) if compact_nbytes else None,
+            "bytes_per_array": channel_nbytes,
+            "bytes_per_driver": {code: driver_telemetry.nbytes for code, driver_telemetry in self.drivers.items()},
+        }
+
+
+def _to_ms(timedeltas) -> np.ndarray:
+    return np.round(timedeltas.dt.total_seconds().to_numpy(dtype=np.float64) * 1000.0).astype(np.int32)
+
+
+def _session_source_nbytes(f1_session) -> int:
+    """Deep memory usage of the laps and raw telemetry frames held by a loaded FastF1 session."""
+    total = int(f1_session.laps.memory_usage(deep=True).sum())
+    for frames in (f1_session.car_data, f1_session.pos_data):
+        total += sum(int(frame.memory_usage(deep=True).sum()) for frame in frames.values())
+    return total
+
+
+def _session_t0_epoch(f1_session) -> Optional[float]:
+    import pandas as pd
+
+    t0_date = getattr(f1_session, 't0_date', None)
+    if t0_date is None or pd.isna(t0_date):
+        return None
+    t0_date = pd.Timestamp(t0_date)
+    if t0_date.tzinfo is None:
+        t0_date = t0_date.tz_localize("UTC")
+    return t0_date.timestamp()
+
+
+def build_driver_telemetry(f1_session, driver_code: str) -> Optional[DriverTelemetry]:
+    """
+    Extracts a driver's timed laps and telemetry from a loaded FastF1 session into a
+    `DriverTelemetry`. The session must have been loaded with laps and telemetry.
+    Returns None if the driver has no usable laps.
+    """
+    import pandas as pd
+
+    driver_laps = f1_session.laps[f1_session.laps['Driver'] == driver_code]
+    driver_laps = driver_laps[pd.notna(driver_laps['LapTime']) & pd.notna(driver_laps['LapStartTime'])]
+    if driver_laps.empty:
+        logger.warning(f"No laps with valid timing found for driver '{driver_code}'. Cannot build telemetry arrays.")
+        return None
+    driver_laps = driver_laps.sort_values(by='LapStartTime')
+
+    lap_start = _to_ms(driver_laps['LapStartTime'])
+    lap_end = lap_start + _to_ms(driver_laps['LapTime'])
+    lap_numbers = driver_laps['LapNumber'].to_numpy(dtype=np.int16)
+
+    telemetry = driver_laps.get_telemetry()
+    missing = [column for column in TELEMETRY_CHANNELS + ["SessionTime"] if column not in telemetry.columns]
+    if missing:
+        raise KeyError(f"Telemetry for driver '{driver_code}' is missing columns: {missing}")
+
+    session_ms = _to_ms(telemetry['SessionTime'])
+    order = np.argsort(session_ms, kind="stable")
+    session_ms = session_ms[order]
+
+    row_lap = np.searchsorted(lap_start, session_ms, side="right") - 1
+    in_lap = (row_lap >= 0) & (session_ms < lap_end[np.clip(row_lap, 0, None)])
+    rows = order[in_lap]
+    session_ms = session_ms[in_lap]
+    row_lap = row_lap[in_lap]
+
+    counts = np.bincount(row_lap, minlength=lap_start.shape[0])
+    has_samples = counts > 0
+    if not has_samples.any():
+        logger.warning(f"No telemetry samples fall inside the timed laps of driver '{driver_code}'.")
+        return None
+    if not has_samples.all():
+        logger.debug(f"Driver {driver_code}: dropping {int((~has_samples).sum())} timed laps without telemetry samples.")
+    lap_offsets = np.concatenate(([0], np.cumsum(counts[has_samples]))).astype(np.int32)
+
+    raw = {column: telemetry[column].to_numpy(dtype=np.float64)[rows] for column in TELEMETRY_CHANNELS}
+    # Distance from a multi-lap telemetry frame accumulates over the whole race; keep it per lap.
+    lap_first_distance = raw["Distance"][lap_offsets[:-1]]
+    raw["Distance"] = raw["Distance"] - np.repeat(lap_first_distance, np.diff(lap_offsets))
+    raw["DRS"] = raw["DRS"] > 0
+    raw["Brake"] = raw["Brake"] > 0
+    for column in ("RPM", "nGear", "Throttle"):
+        info = np.iinfo(CHANNEL_DTYPES[column])
+        raw[column] = np.clip(np.round(np.nan_to_num(raw[column])), info.min, info.max)
+    channels = {column: raw[column].astype(dtype) for column, dtype in CHANNEL_DTYPES.items()}
+
+    driver_telemetry = DriverTelemetry(
+        driver_code=driver_code,
+        lap_numbers=lap_numbers[has_samples],
+        lap_start_ms=lap_start[has_samples],
+        lap_end_ms=lap_end[has_samples],
+        lap_offsets=lap_offsets,
+        session_ms=session_ms,
+        channels=channels,
+    )
+    logger.info(f"Built telemetry arrays for {driver_code}: {driver_telemetry.lap_count} laps, {driver_telemetry.sample_count} samples, {driver_telemetry.nbytes / 1024:.0f} KiB.")
+    return driver_telemetry
+
+
+def build_session_store(
+    f1_session,
+    year: int,
+    session_identifier: str,
+    driver_codes: Optional[List[str]] = None,
+    mini_sector_count: int = DEFAULT_MINI_SECTOR_COUNT
+) -> SessionTelemetryStore:
+    """
+    Builds the compact store for the given drivers (default: every driver with laps) of a
+    session loaded with laps and telemetry, plus the circuit's track index. The caller can
+    drop the session afterwards.
+    """
+    if driver_codes is None:
+        driver_codes = [code for code in f1_session.laps['Driver'].dropna().unique()]
+
+    source_nbytes = _session_source_nbytes(f1_session)
+    drivers: Dict[str, DriverTelemetry] = {}
+    for driver_code in driver_codes:
+        try:
+            driver_telemetry = build_driver_telemetry(f1_session, driver_code)
+        except Exception as e:
+            logger.error(f"Failed to build telemetry arrays for {driver_code}: {e}")
+            continue
+        if driver_telemetry is not None:
+            drivers[driver_code] = driver_telemetry
+
+    event_name = f1_session.event['EventName'] if hasattr(f1_session, 'event') else ""
+    try:
+        session_t0_epoch = _session_t0_epoch(f1_session)
+    except Exception as e:
+        logger.warning(f"Could not determine the wall-clock start of the session: {e}")
+        session_t0_epoch = None
+    try:
+        track_index = build_track_index(f1_session, mini_sector_count)
+    except Exception as e:
+        logger.warning(f"Could not build the track index: {e}")
+        track_index = None
+    store = SessionTelemetryStore(year, event_name, session_identifier, drivers, source_nbytes, session_t0_epoch, track_index)
+    logger.info(f"Compact telemetry store for {year} {event_name} {session_identifier}: {len(drivers)} drivers, {store.nbytes / 2**20:.1f} MiB (source session {source_nbytes / 2**20:.1f} MiB).")
+    return store
@@ -0,0 +1,208 @@
+import logging
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MINI_SECTOR_COUNT = 25
+# Spacing of the resampled centreline. Lookups are refined onto the segments around the
+# nearest point, so this only bounds the index size, not the precision.
+CENTRELINE_STEP_M = 5.0
+
+
+class TrackIndex:
+    """
+    Spatial index of one circuit's centreline, built once from a reference lap.
+
+    Maps X/Y positions (FastF1 position units) to distance along the lap in metres, the
+    same scale as the telemetry `Distance` channel, and from there to sector and
+    mini-sector. Each lookup is a KD-tree query, O(log n) in the centreline length,
+    followed by a projection onto the two segments around the nearest point.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, distance: np.ndarray, sector_ends_m: Sequence[float], mini_sector_count: int = DEFAULT_MINI_SECTOR_COUNT):
+        self.x = x
+        self.y = y
+        self.distance = distance
+        # Distances at which sectors 1 and 2 end; sector 3 runs to the line.
+        self.sector_ends_m = np.asarray(sector_ends_m, dtype=np.float64)
+        self.mini_sector_count = int(mini_sector_count)
+        self._tree = None
+
+    @classmethod
+    def from_reference_lap(
+        cls,
+        x: np.ndarray,
+        y: np.ndarray,
+        distance: np.ndarray,
+        sector_ends_m: Optional[Sequence[float]] = None,
+        mini_sector_count: int = DEFAULT_MINI_SECTOR_COUNT,
+        step_m: float = CENTRELINE_STEP_M
+    ) -> "TrackIndex":
+        """Resamples a reference lap's X/Y trace to a centreline point every `step_m` metres of lap distance."""
+        distance = np.asarray(distance, dtype=np.float64)
+        valid = np.isfinite(distance) & np.isfinite(x) & np.isfinite(y)
+        distance, x, y = distance[valid] - distance[valid][0], np.asarray(x, dtype=np.float64)[valid], np.asarray(y, dtype=np.float64)[valid]
+        # np.interp needs strictly increasing sample points; drop samples taken while stationary.
+        keep = np.concatenate(([True], np.diff(distance) > 0))
+        distance, x, y = distance[keep], x[keep], y[keep]
+        if distance.size < 2:
+            raise ValueError("Reference lap has fewer than two distinct positions.")
+
+        length_m = float(distance[-1])
+        grid = np.append(np.arange(0.0, length_m, step_m), length_m)
+        if sector_ends_m is None:
+            sector_ends_m = (length_m / 3.0, 2.0 * length_m / 3.0)
+        return cls(
+            x=np.interp(grid, distance, x).astype(np.float32),
+            y=np.interp(grid, distance, y).astype(np.float32),
+            distance=grid.astype(np.float32),
+            sector_ends_m=sector_ends_m,
+            mini_sector_count=mini_sector_count,
+        )
+
+    @property
+    def length_m(self) -> float:
+        return float(self.distance[-1])
+
+    @property
+    def point_count(self) -> int:
+        return int(self.distance.shape[0])
+
+    @property
+    def mini_sector_bounds_m(self) -> np.ndarray:
+        """Start distance of each mini-sector plus the lap length, mini-sectors being equal slices of the lap."""
+        return np.linspace(0.0, self.length_m, self.mini_sector_count + 1)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "x": self.x,
+            "y": self.y,
+            "distance": self.distance,
+            "sector_ends_m": self.sector_ends_m,
+            "mini_sector_count": np.array([self.mini_sector_count], dtype=np.int32),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "TrackIndex":
+        return cls(
+            x=arrays["x"],
+            y=arrays["y"],
+            distance=arrays["distance"],
+            sector_ends_m=np.asarray(arrays["sector_ends_m"]),
+            mini_sector_count=int(arrays["mini_sector_count"][0]),
+        )
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(np.column_stack((self.x, self.y)).astype(np.float64))
+        return self._tree
+
+    def sector_at(self, distance: np.ndarray) -> np.ndarray:
+        return (np.searchsorted(self.sector_ends_m, distance, side="right") + 1).astype(np.int8)
+
+    def mini_sector_at(self, distance: np.ndarray) -> np.ndarray:
+        mini_sector = np.floor(np.asarray(distance) / self.length_m * self.mini_sector_count).astype(np.int16) + 1
+        return np.clip(mini_sector, 1, self.mini_sector_count)
+
+    def position_at(self, distance) -> Tuple[np.ndarray, np.ndarray]:
+        """X/Y of the centreline at lap distances (m), the inverse of `locate` for points on the line."""
+        distance = np.asarray(distance, dtype=np.float64)
+        return np.interp(distance, self.distance, self.x), np.interp(distance, self.distance, self.y)
+
+    def locate(self, x, y) -> Dict[str, np.ndarray]:
+        """
+        Batched lookup of X/Y positions. Returns arrays of lap distance (m), lap fraction,
+        sector (1-3), mini-sector (1-N) and lateral offset from the centreline (X/Y units).
+        """
+        points = np.column_stack((np.atleast_1d(np.asarray(x, dtype=np.float64)), np.atleast_1d(np.asarray(y, dtype=np.float64))))
+        _, nearest = self.tree.query(points)
+
+        # Project onto the segment before and after the nearest centreline point and keep the closer one.
+        last_segment = self.point_count - 2
+        best_distance = np.empty(points.shape[0], dtype=np.float64)
+        best_offset = np.full(points.shape[0], np.inf, dtype=np.float64)
+        for start in (np.clip(nearest - 1, 0, last_segment), np.clip(nearest, 0, last_segment)):
+            ax, ay = self.x[start].astype(np.float64), self.y[start].astype(np.float64)
+            dx, dy = self.x[start + 1] - ax, self.y[start + 1] - ay
+            segment_sq = dx * dx + dy * dy
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(segment_sq > 0, ((points[:, 0] - ax) * dx + (points[:, 1] - ay) * dy) / segment_sq, 0.0)
+            t = np.clip(t, 0.0, 1.0)
+            offset = np.hypot(points[:, 0] - (ax + t * dx), points[:, 1] - (ay + t * dy))
+            closer = offset < best_offset
+            best_offset[closer] = offset[closer]
+            d0 = self.distance[start].astype(np.float64)
+            best_distance[closer] = (d0 + t * (self.distance[start + 1] - d0))[closer]
+
+        return {
+            "distance": best_distance,
+            "lap_fraction": best_distance / self.length_m,
+            "sector": self.sector_at(best_distance),
+            "mini_sector": self.mini_sector_at(best_distance),
+            "lateral_offset": best_offset,
+        }
+
+    def locate_one(self, x: float, y: float) -> Dict[str, Any]:
+        located = self.locate(x, y)
+        return {name: values[0].item() for name, values in located.items()}
+
+    def describe(self) -> Dict[str, Any]:
+        """Centreline and sector/mini-sector boundaries, for clients that draw the track."""
+        return {
+            "length_m": round(self.length_m, 1),
+            "sector_ends_m": [round(float(end), 1) for end in self.sector_ends_m],
+            "mini_sector_count": self.mini_sector_count,
+            "mini_sector_bounds_m": [round(float(bound), 1) for bound in self.mini_sector_bounds_m],
+            "centreline": {
+                "x": self.x.tolist(),
+                "y": self.y.tolist(),
+                "distance": self.distance.tolist(),
+            },
+        }
+
+
+def _sector_ends_m(reference_lap, telemetry) -> Optional[Sequence[float]]:
+    """Lap distances at which the reference lap crossed the sector 1 and 2 lines, from its sector session times."""
+    import pandas as pd
+
+    crossings = [reference_lap.get("Sector1SessionTime"), reference_lap.get("Sector2SessionTime")]
+    if any(crossing is None or pd.isna(crossing) for crossing in crossings):
+        return None
+    session_seconds = telemetry["SessionTime"].dt.total_seconds().to_numpy(dtype=np.float64)
+    distance = telemetry["Distance"].to_numpy(dtype=np.float64)
+    distance = distance - distance[0]
+    return [float(np.interp(crossing.total_seconds(), session_seconds, distance)) for crossing in crossings]
+
+
+def build_track_index(f1_session, mini_sector_count: int = DEFAULT_MINI_SECTOR_COUNT) -> Optional[TrackIndex]:
+    """
+    Builds the track index from the fastest lap of a session loaded with laps and
+    telemetry. Returns None if no lap with position data is available.
+    """
+    reference_lap = f1_session.laps.pick_fastest()
+    if reference_lap is None or len(reference_lap) == 0:
+        logger.warning("No fastest lap to build the track index from.")
+        return None
+
+    telemetry = reference_lap.get_telemetry()
+    if telemetry is None or telemetry.empty or not {"X", "Y", "Distance", "SessionTime"}.issubset(telemetry.columns):
+        logger.warning(f"Fastest lap of {reference_lap.get('Driver')} has no position telemetry; no track index built.")
+        return None
+
+    sector_ends_m = _sector_ends_m(reference_lap, telemetry)
+    if sector_ends_m is None:
+        logger.warning("Reference lap has no sector times; splitting the lap into equal thirds.")
+    track_index = TrackIndex.from_reference_lap(
+        telemetry["X"].to_numpy(dtype=np.float64),
+        telemetry["Y"].to_numpy(dtype=np.float64),
+        telemetry["Distance"].to_numpy(dtype=np.float64),
+        sector_ends_m,
+        mini_sector_count,
+    )
+    logger.info(f"Track index from {reference_lap.get('Driver')}'s lap {reference_lap.get('LapNumber')}: {track_index.length_m:.0f} m, {track_index.point_count} centreline points, {track_index.mini_sector_count} mini-sectors.")
+    return track_index
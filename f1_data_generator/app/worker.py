@@ -0,0 +1,66 @@
+"""
+Dedicated generator process for multi-worker deployments.
+
+Builds the generator session's telemetry store once, publishes it as memory-mapped
+files under SHARED_STORE_PATH for the API workers (GENERATOR_MODE=api), and is the
+only process pushing updates to Orion and maintaining the etcar rollups.
+
+    GENERATOR_MODE=worker SHARED_STORE_PATH=/dev/shm/f1_store python -m app.worker
+"""
+import os
+
+os.environ.setdefault("GENERATOR_MODE", "worker")
+
+import logging
+import time
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from app import main as service
+
+
+logger = logging.getLogger(__name__)
+
+STORE_RETRY_SECONDS = int(os.getenv("STORE_RETRY_SECONDS", 30))
+
+
+def publish_store_until_ready():
+    """Loads and publishes the session store, retrying until the session data is available."""
+    while True:
+        try:
+            service.get_generator_store()
+            return
+        except Exception as e:
+            logger.error(f"Failed to prepare generator session data: {e}. Retrying in {STORE_RETRY_SECONDS}s...")
+            time.sleep(STORE_RETRY_SECONDS)
+
+
+def run():
+    if service.GENERATOR_MODE != "worker":
+        raise ValueError(f"app.worker must run with GENERATOR_MODE=worker, got '{service.GENERATOR_MODE}'.")
+
+    publish_store_until_ready()
+    service.startup_timer.mark_ready()
+    service.startup_timer.log_report()
+
+    scheduler = BlockingScheduler()
+    scheduler.add_job(
+        service.generate_and_push_data,
+        trigger=IntervalTrigger(seconds=service.SCHEDULE_INTERVAL_SECONDS),
+        id="f1_data_job",
+        name="F1 Data Generation and Push",
+        replace_existing=True,
+        max_instances=1,
+        misfire_grace_time=10
+    )
+    service.add_rollup_job(scheduler)
+    logger.info(f"Generator worker running. Job 'f1_data_job' scheduled to run every {service.SCHEDULE_INTERVAL_SECONDS} seconds.")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Generator worker shutting down.")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from app.race_order import compute_running_order
+from app.telemetry_store import CHANNEL_DTYPES, DriverTelemetry, SessionTelemetryStore
+
+
+TRACK_LENGTH_M = 5000.0
+RACE_START_S = 100.0
+SAMPLE_STEP_S = 0.05
+
+
+def constant_speed_driver(driver_code, speed_mps, laps=4, missing_laps=()):
+    """A driver lapping at constant speed from race start, with `missing_laps` dropped as if they had no LapTime."""
+    lap_seconds = TRACK_LENGTH_M / speed_mps
+    lap_numbers, lap_start, lap_end, lap_offsets, session_seconds, distance = [], [], [], [0], [], []
+    for lap_number in range(1, laps + 1):
+        if lap_number in missing_laps:
+            continue
+        start = RACE_START_S + (lap_number - 1) * lap_seconds
+        sample_times = np.arange(start, start + lap_seconds, SAMPLE_STEP_S)
+        lap_numbers.append(lap_number)
+        lap_start.append(start)
+        lap_end.append(start + lap_seconds)
+        lap_offsets.append(lap_offsets[-1] + sample_times.size)
+        session_seconds.append(sample_times)
+        distance.append((sample_times - start) * speed_mps)
+
+    session_seconds = np.concatenate(session_seconds)
+    arrays = {
+        "lap_numbers": np.array(lap_numbers, dtype=np.int16),
+        "lap_start_ms": np.round(np.array(lap_start) * 1000.0).astype(np.int32),
+        "lap_end_ms": np.round(np.array(lap_end) * 1000.0).astype(np.int32),
+        "lap_offsets": np.array(lap_offsets, dtype=np.int32),
+        "session_ms": np.round(session_seconds * 1000.0).astype(np.int32),
+    }
+    arrays.update({f"channel_{name}": np.zeros(session_seconds.size, dtype=dtype) for name, dtype in CHANNEL_DTYPES.items()})
+    arrays["channel_Distance"] = np.concatenate(distance).astype(np.float32)
+    return DriverTelemetry.from_arrays(driver_code, arrays)
+
+
+def make_store(**drivers):
+    return SessionTelemetryStore(2023, "Test Grand Prix", "R", drivers, source_nbytes=0)
+
+
+@pytest.mark.parametrize("simulated_seconds", [20.0, 60.0, 95.0])
+def test_missing_first_lap_keeps_the_common_clock(simulated_seconds):
+    # BBB's lap 1 has no LapTime, so its telemetry starts at lap 2; it must not be timed from there.
+    store = make_store(AAA=constant_speed_driver("AAA", 50.0), BBB=constant_speed_driver("BBB", 48.0, missing_laps=(1,)))
+    standings = compute_running_order(store, simulated_seconds)
+
+    assert standings["AAA"]["race_position"] == 1
+    assert standings["BBB"]["race_position"] == 2
+    assert standings["BBB"]["race_distance"] == pytest.approx(48.0 * simulated_seconds, abs=25.0)
+    assert standings["BBB"]["gap_to_leader"] == pytest.approx(0.04 * simulated_seconds, abs=0.1)
+
+
+def test_missing_mid_race_lap_is_interpolated():
+    # BBB's lap 2 is missing: the car must keep moving through it and the gap must grow steadily.
+    store = make_store(AAA=constant_speed_driver("AAA", 50.0), BBB=constant_speed_driver("BBB", 48.0, missing_laps=(2,)))
+    lap_two_seconds = np.arange(TRACK_LENGTH_M / 48.0, 2.0 * TRACK_LENGTH_M / 48.0, 5.0)
+
+    distances, gaps = [], []
+    for simulated_seconds in lap_two_seconds:
+        standings = compute_running_order(store, float(simulated_seconds))
+        assert standings["BBB"]["race_position"] == 2
+        distances.append(standings["BBB"]["race_distance"])
+        gaps.append(standings["BBB"]["gap_to_leader"])
+
+    assert np.all(np.diff(distances) > 0)
+    assert gaps == pytest.approx(list(0.04 * lap_two_seconds), abs=0.1)
+
+
+def test_finished_cars_are_ordered_by_flag():
+    store = make_store(AAA=constant_speed_driver("AAA", 50.0), BBB=constant_speed_driver("BBB", 48.0, missing_laps=(2,)))
+    standings = compute_running_order(store, 1000.0)
+
+    assert [standings[code]["race_position"] for code in ("AAA", "BBB")] == [1, 2]
+    assert standings["BBB"]["gap_to_leader"] == pytest.approx(4.0 * TRACK_LENGTH_M * (1 / 48.0 - 1 / 50.0), abs=0.1)
+
+
+@pytest.mark.parametrize("missing_lap", [1, 2])
+@pytest.mark.parametrize("simulated_seconds", [20.0, 60.0, 95.0, 130.0, 180.0])
+def test_sampled_lap_and_distance_match_race_distance(missing_lap, simulated_seconds):
+    store = make_store(AAA=constant_speed_driver("AAA", 50.0), BBB=constant_speed_driver("BBB", 48.0, missing_laps=(missing_lap,)))
+    standings = compute_running_order(store, simulated_seconds)
+    track_length_m = store.track_length_m
+
+    for driver_code in ("AAA", "BBB"):
+        point = store.sample_point(driver_code, simulated_seconds)
+        sampled_race_distance = (point["target_lap_number"] - 1) * track_length_m + point["distance"]
+        assert sampled_race_distance == pytest.approx(standings[driver_code]["race_distance"], abs=25.0)
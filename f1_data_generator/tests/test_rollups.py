@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from app import rollups
+
+
+@pytest.fixture
+def crate(monkeypatch):
+    """Runs the rollup statements on SQLite, which has the window functions and upserts they use."""
+    connection = sqlite3.connect(":memory:")
+    connection.execute("ATTACH DATABASE ':memory:' AS doc")
+
+    def execute_sql(crate_url, stmt, args=None, bulk_args=None):
+        cursor = connection.execute(stmt, args or [])
+        return {"rows": cursor.fetchall(), "rowcount": cursor.rowcount}
+
+    monkeypatch.setattr(rollups, "execute_sql", execute_sql)
+    for tier in rollups.ROLLUP_TIERS:
+        connection.execute(rollups._table_ddl(tier))
+    return connection
+
+
+def insert_seconds(connection, entity_id, lap_seconds, start_ms):
+    """One 1 s bucket per second, driving the laps of `lap_seconds` ({lap number: seconds}) in order from `start_ms`."""
+    bucket = start_ms
+    for lap_number, seconds in lap_seconds.items():
+        for _ in range(seconds):
+            connection.execute(
+                f"INSERT INTO {rollups.ROLLUP_TIERS_BY_NAME['1s'].table} ({', '.join(rollups.ROLLUP_COLUMNS)}) "
+                f"VALUES (?, 'NOR', 1, ?, ?, ?, 4, 200, 300, 250, 10000, 11000, 10500, 0.5)",
+                [entity_id, lap_number, bucket, bucket + 1000],
+            )
+            bucket += 1000
+
+
+def lap_rows(connection):
+    return connection.execute(
+        f"SELECT lapnumber, bucket, bucket_end, samples FROM {rollups.ROLLUP_TIERS_BY_NAME['lap'].table} ORDER BY bucket"
+    ).fetchall()
+
+
+def test_replays_of_the_same_lap_keep_their_own_rows(crate):
+    entity_id = "urn:ngsi-v2:Car:NOR:1"
+    insert_seconds(crate, entity_id, {5: 90, 6: 85}, start_ms=1_000_000)
+    insert_seconds(crate, entity_id, {5: 80, 6: 88}, start_ms=5_000_000)
+
+    rollups._refresh_lap("crate", None, None, lap_lookback_seconds=900)
+
+    assert lap_rows(crate) == [
+        (5, 1_000_000, 1_090_000, 360),
+        (6, 1_090_000, 1_175_000, 340),
+        (5, 5_000_000, 5_080_000, 320),
+        (6, 5_080_000, 5_168_000, 352),
+    ]
+
+
+def test_incremental_refresh_leaves_earlier_replays_alone(crate):
+    entity_id = "urn:ngsi-v2:Car:NOR:1"
+    insert_seconds(crate, entity_id, {5: 90}, start_ms=1_000_000)
+    rollups._refresh_lap("crate", None, None, lap_lookback_seconds=900)
+    # The replay starts within the lookback of the first one, after a restart gap.
+    insert_seconds(crate, entity_id, {5: 70}, start_ms=1_300_000)
+
+    rollups._refresh_lap("crate", 1_360_000, None, lap_lookback_seconds=900)
+
+    assert lap_rows(crate) == [(5, 1_000_000, 1_090_000, 360), (5, 1_300_000, 1_370_000, 280)]
@@ -1,13 +1,14 @@
+import time
+_script_start = time.perf_counter()
+
 import streamlit as st
-import fastf1
-import fastf1.plotting
-import fastf1.core
-import matplotlib.pyplot as plt
 from crate import client
 from crate.client.exceptions import ProgrammingError 
 import os
-import time
+import json
+import threading
 import logging
+import requests
 import pandas as pd
 import datetime
 import numpy as np
@@ -18,28 +19,60 @@ LAYOUT_GP = "Monza"
 LAYOUT_SESSION = "R"
 REFRESH_INTERVAL = 5
 FASTF1_CACHE_PATH = "./fastf1_cache_streamlit"
+GENERATOR_STREAM_URL = os.getenv("GENERATOR_STREAM_URL")
+LIVE_REFRESH_INTERVAL = float(os.getenv("LIVE_REFRESH_INTERVAL", 0.5))
+LIVE_STALE_SECONDS = float(os.getenv("LIVE_STALE_SECONDS", 3))
+GENERATOR_API_URL = os.getenv("GENERATOR_API_URL")
+MINI_SECTOR_COLORS = ("#8a8d96", "#d9dbe0")
 
 
 logging.basicConfig(level="DEBUG", format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 logger.info(f"Log level set to: {logging.getLevelName(logger.level)}")
 logger.info(f"CrateDB Host: {CRATE_HOSTS}")
-
-try:
-    if not os.path.exists(FASTF1_CACHE_PATH): os.makedirs(FASTF1_CACHE_PATH)
-    fastf1.Cache.enable_cache(FASTF1_CACHE_PATH)
-    logger.info(f"FastF1 cache enabled at: {FASTF1_CACHE_PATH}")
-except Exception as e: logger.warning(f"Could not configure FastF1 cache: {e}")
-
-try:
-    fastf1.plotting.setup_mpl(mpl_timedelta_support=True, color_scheme=None, misc_mpl_mods=True)
-    logger.info("Applied FastF1 Matplotlib base styles.")
-except Exception as e: logger.warning(f"Could not apply FastF1 base plotting style: {e}")
+logger.info(f"Generator live stream: {GENERATOR_STREAM_URL or 'disabled (polling CrateDB)'}")
+logger.info(f"Generator track index: {GENERATOR_API_URL or 'disabled (plain track outline)'}")
+
+startup_phases = []; _last_phase_mark = _script_start
+def mark_phase(name):
+    """Records the time since the previous mark as a startup phase of this script run."""
+    global _last_phase_mark
+    now = time.perf_counter(); startup_phases.append((name, now - _last_phase_mark)); _last_phase_mark = now
+
+def log_startup_report():
+    summary = ", ".join(f"{name}={duration * 1000:.1f}ms" for name, duration in startup_phases)
+    logger.info(f"Startup report: first render after {(time.perf_counter() - _script_start) * 1000:.1f} ms ({summary})")
+
+mark_phase("imports")
+
+@st.cache_resource(show_spinner=False)
+def get_fastf1():
+    """Imports FastF1 and enables its cache once per process, on first use."""
+    import fastf1
+    import fastf1.core
+    try:
+        if not os.path.exists(FASTF1_CACHE_PATH): os.makedirs(FASTF1_CACHE_PATH)
+        fastf1.Cache.enable_cache(FASTF1_CACHE_PATH)
+        logger.info(f"FastF1 cache enabled at: {FASTF1_CACHE_PATH}")
+    except Exception as e: logger.warning(f"Could not configure FastF1 cache: {e}")
+    return fastf1
+
+@st.cache_resource(show_spinner=False)
+def get_pyplot():
+    """Imports Matplotlib and applies the FastF1 styles once per process, just before the first plot."""
+    import fastf1.plotting
+    import matplotlib.pyplot as plt
+    try:
+        fastf1.plotting.setup_mpl(mpl_timedelta_support=True, color_scheme=None, misc_mpl_mods=True)
+        logger.info("Applied FastF1 Matplotlib base styles.")
+    except Exception as e: logger.warning(f"Could not apply FastF1 base plotting style: {e}")
+    return plt
 
 
 @st.cache_data(ttl=3600)
 def get_circuit_info_and_session(year, gp, session_id):
     logger.info(f"Loading session and circuit layout for {year} {gp} {session_id}")
+    fastf1 = get_fastf1()
     try:
         session = fastf1.get_session(year, gp, session_id)
         session.load(laps=True, telemetry=True, weather=False, messages=False, livedata=None)
@@ -64,6 +97,27 @@ def get_circuit_info_and_session(year, gp, session_id):
         st.error(f"Failed to load FastF1 data: {e}")
         return None, None, None, None
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_track_layout(api_url):
+    """Centreline, sector ends and mini-sector bounds from the generator's track index (GET /api/v1/f1data/track)."""
+    try:
+        response = requests.get(f"{api_url.rstrip('/')}/api/v1/f1data/track", timeout=30); response.raise_for_status()
+        layout = response.json()
+        logger.info(f"Track layout from generator: {layout['year']} {layout['gp']} {layout['session']}, {layout['length_m']:.0f} m, {layout['mini_sector_count']} mini-sectors.")
+        return layout
+    except Exception as e:
+        logger.warning(f"Track layout unavailable from {api_url}: {e}. Drawing the plain outline.")
+        return None
+
+def locate_on_track(api_url, position):
+    """Lap distance, sector and mini-sector of one X/Y position (GET /api/v1/f1data/track/locate), or None."""
+    try:
+        response = requests.get(f"{api_url.rstrip('/')}/api/v1/f1data/track/locate", params={"x": position[0], "y": position[1]}, timeout=2); response.raise_for_status()
+        return response.json()["positions"][0]
+    except Exception as e:
+        logger.debug(f"Track locate failed: {e}")
+        return None
+
 def connect_crate(crate_hosts):
     """Establishes connection to CrateDB."""
     try:
@@ -93,6 +147,47 @@ def close_db_connection():
         except Exception as e: logger.error(f"Error closing CrateDB connection: {e}")
         st.session_state.crate_conn = None
 
+def stream_track_position(car):
+    """Track position the generator already put in a stream frame, in the shape `locate_on_track` returns, or None."""
+    if car.get("sector") is None or car.get("miniSector") is None: return None
+    return {"sector": car["sector"], "mini_sector": car["miniSector"], "distance": car["distance"], "lap_fraction": car.get("lapFraction") or 0.0}
+
+class LiveStreamListener:
+    """Follows the generator's SSE feed in a background thread, keeping the latest position and track position per entity.
+    Positions not refreshed within LIVE_STALE_SECONDS are not returned, so callers fall back to CrateDB."""
+    def __init__(self, url):
+        self.url = url
+        self.latest = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="live-stream-listener", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with requests.get(self.url, stream=True, timeout=(5, 60)) as response:
+                    response.raise_for_status()
+                    logger.info(f"Connected to generator live stream at {self.url}")
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"): continue
+                        frame = json.loads(line[5:])
+                        timestamp = pd.to_datetime(frame["dateObserved"], utc=True)
+                        received_at = time.monotonic()
+                        with self.lock:
+                            for car in frame.get("cars", []): self.latest[car["id"]] = ((car["x"], car["y"]), timestamp, received_at, stream_track_position(car))
+            except Exception as e: logger.warning(f"Generator live stream unavailable ({e}). Retrying...")
+            with self.lock: self.latest.clear()
+            time.sleep(2)
+
+    def get_latest(self, entity_id):
+        with self.lock: entry = self.latest.get(entity_id)
+        if entry is None or time.monotonic() - entry[2] > LIVE_STALE_SECONDS: return None, None, None
+        return entry[0], entry[1], entry[3]
+
+@st.cache_resource
+def get_live_stream_listener(url):
+    return LiveStreamListener(url)
+
 def get_latest_driver_position(conn, entity_id):
     """Queries CrateDB for the latest X, Y coords. Assumes conn is valid."""
     if conn is None: return None, None
@@ -125,6 +220,7 @@ def get_latest_driver_position(conn, entity_id):
             except Exception: pass
 
 def get_driver_info(entity_id, session):
+    import fastf1.plotting
     default_abbr = "UNK"; default_color = "#CCCCCC"
     driver_abbr = default_abbr; driver_color = default_color
     if not entity_id or not session: return default_abbr, default_color
@@ -163,6 +259,7 @@ st.markdown(
 
 st.title("Live Position Tracker")
 st.subheader("Track a Driver's Position")
+mark_phase("page_render")
 
 TARGET_ENTITY_ID = st.text_input(
     "Enter NGSI Entity ID (e.g., urn:ngsi-v2:Car:VER:2023):",
@@ -171,12 +268,18 @@ TARGET_ENTITY_ID = st.text_input(
 
 if not TARGET_ENTITY_ID: st.error("Please provide a valid NGSI Entity ID."); st.stop()
 
+get_fastf1()
+mark_phase("fastf1_import")
 circuit_info, track_x, track_y, f1_session = get_circuit_info_and_session(LAYOUT_YEAR, LAYOUT_GP, LAYOUT_SESSION)
 if circuit_info is None: logger.critical("Failed to load FastF1 data."); st.stop() 
+track_layout = get_track_layout(GENERATOR_API_URL) if GENERATOR_API_URL else None
+mark_phase("layout_load")
 
 driver_abbr, driver_color = get_driver_info(TARGET_ENTITY_ID, f1_session)
 st.caption(f"Using {LAYOUT_YEAR} {LAYOUT_GP} {LAYOUT_SESSION} layout. Tracking: **{driver_abbr}** (Color: {driver_color})")
 
+plt = get_pyplot()
+mark_phase("mpl_setup")
 fig, ax = plt.subplots(figsize=(12, 12))
 fig.patch.set_facecolor(background_color)
 ax.patch.set_facecolor(background_color)
@@ -185,9 +288,25 @@ ax.axis('off'); ax.set_aspect('equal', adjustable='box')
 try:
     rotation_angle = circuit_info.rotation / 180 * np.pi if hasattr(circuit_info, 'rotation') and circuit_info.rotation is not None else 0
     if rotation_angle == 0: logger.warning("CircuitInfo has no 'rotation'. Assuming 0.")
+    if track_layout:
+        # Draw the generator's centreline so mini-sectors and sector lines match what it reports.
+        centreline = track_layout["centreline"]
+        track_x, track_y = np.asarray(centreline["x"]), np.asarray(centreline["y"])
+        track_distance = np.asarray(centreline["distance"])
     track_x_rotated = track_x * np.cos(rotation_angle) - track_y * np.sin(rotation_angle)
     track_y_rotated = track_x * np.sin(rotation_angle) + track_y * np.cos(rotation_angle)
-    ax.plot(track_x_rotated, track_y_rotated, color='white', linewidth=1.5, solid_capstyle='round')
+    if track_layout:
+        from matplotlib.collections import LineCollection
+        mini_sector_bounds = np.asarray(track_layout["mini_sector_bounds_m"])
+        track_mini_sectors = np.clip(np.searchsorted(mini_sector_bounds, track_distance, side="right"), 1, track_layout["mini_sector_count"])
+        track_segments = np.stack((np.column_stack((track_x_rotated[:-1], track_y_rotated[:-1])), np.column_stack((track_x_rotated[1:], track_y_rotated[1:]))), axis=1)
+        ax.add_collection(LineCollection(track_segments, colors=[MINI_SECTOR_COLORS[ms % 2] for ms in track_mini_sectors[:-1]], linewidths=2.5, capstyle='round'))
+        for sector_no, sector_end in enumerate(track_layout["sector_ends_m"], start=1):
+            sx, sy = np.interp(sector_end, track_distance, track_x_rotated), np.interp(sector_end, track_distance, track_y_rotated)
+            ax.scatter(sx, sy, color='#ffd12e', marker='|', s=200, linewidths=2, zorder=5)
+            ax.text(sx, sy, f" S{sector_no}/S{sector_no + 1}", color='#ffd12e', fontsize=8, ha='left', va='bottom', zorder=5)
+    else:
+        ax.plot(track_x_rotated, track_y_rotated, color='white', linewidth=1.5, solid_capstyle='round')
     x_min, x_max = np.min(track_x_rotated), np.max(track_x_rotated)
     y_min, y_max = np.min(track_y_rotated), np.max(track_y_rotated)
     padding_x = (x_max - x_min) * 0.05; padding_y = (y_max - y_min) * 0.05
@@ -198,17 +317,22 @@ except Exception as plot_err: logger.error(f"Error preparing track plot: {plot_e
 plot_placeholder = st.empty()
 status_placeholder = st.empty()
 
-driver_scatter = None; driver_text = None
+driver_scatter = None; driver_text = None; mini_sector_highlight = None
+located_position = None; located_track_pos = None
+first_render_logged = False
 connection_attempts = 0; MAX_CONNECTION_ATTEMPTS = 3
+live_listener = get_live_stream_listener(GENERATOR_STREAM_URL) if GENERATOR_STREAM_URL else None
 
 try:
     while True:
-        position, time_idx = None, None
+        position, time_idx, track_pos = None, None, None
         crate_conn = None
+        if live_listener: position, time_idx, track_pos = live_listener.get_latest(TARGET_ENTITY_ID)
 
         try:
-            crate_conn = get_db_connection()
-            position, time_idx = get_latest_driver_position(crate_conn, TARGET_ENTITY_ID)
+            if position is None:
+                crate_conn = get_db_connection()
+                position, time_idx = get_latest_driver_position(crate_conn, TARGET_ENTITY_ID)
             connection_attempts = 0 
         except ProgrammingError as e:
             if "Connection closed" in str(e) and connection_attempts < MAX_CONNECTION_ATTEMPTS:
@@ -225,12 +349,20 @@ try:
             time.sleep(REFRESH_INTERVAL)
             continue
 
+        # Live frames carry the sector already; only positions read from CrateDB are located, once per new position.
+        if track_pos is None and track_layout and position:
+            if position != located_position: located_position, located_track_pos = position, locate_on_track(GENERATOR_API_URL, position)
+            track_pos = located_track_pos
+
         if time_idx:
             now_utc = datetime.datetime.now(datetime.timezone.utc); time_diff = now_utc - time_idx
             time_diff_str = f"{time_diff.total_seconds():.1f}s ago"
             if time_diff.total_seconds() < 0: time_diff_str = f"{abs(time_diff.total_seconds()):.1f}s in future?"
             elif time_diff.total_seconds() > 300: time_diff_str += " (stale?)"
-            status_placeholder.info(f"Tracking {driver_abbr} ({driver_color}). Last: {time_idx.strftime('%H:%M:%S.%f')[:-3]} UTC ({time_diff_str})")
+            track_pos_str = ""
+            if track_pos:
+                track_pos_str = f" | S{track_pos['sector']} · Mini-sector {track_pos['mini_sector']}/{track_layout['mini_sector_count']} · {track_pos['distance']:.0f} m ({track_pos['lap_fraction']:.1%})"
+            status_placeholder.info(f"Tracking {driver_abbr} ({driver_color}). Last: {time_idx.strftime('%H:%M:%S.%f')[:-3]} UTC ({time_diff_str}){track_pos_str}")
         else:
              if connection_attempts == 0: status_placeholder.warning(f"Waiting for {driver_abbr} position data...")
 
@@ -248,12 +380,20 @@ try:
                 pass 
             driver_text = None
 
+        if mini_sector_highlight:
+            try: mini_sector_highlight.remove()
+            except Exception: pass
+            mini_sector_highlight = None
+
         if position:
             try:
                 x, y = position
                 rotated_x = x * np.cos(rotation_angle) - y * np.sin(rotation_angle)
                 rotated_y = x * np.sin(rotation_angle) + y * np.cos(rotation_angle)
                 driver_scatter = ax.scatter(rotated_x, rotated_y, color=driver_color, edgecolor='white', linewidth=0.5, marker='o', s=140, zorder=10)
+                if track_pos:
+                    in_mini_sector = track_mini_sectors == track_pos['mini_sector']
+                    mini_sector_highlight, = ax.plot(np.where(in_mini_sector, track_x_rotated, np.nan), np.where(in_mini_sector, track_y_rotated, np.nan), color=driver_color, linewidth=4, solid_capstyle='round', zorder=6)
                 plot_width = x_max - x_min; plot_height = y_max - y_min
                 padding = (plot_width + plot_height) / 2 * 0.018
                 text_offset_x = padding * np.sign(rotated_x) if abs(rotated_x) > 1e-3 else padding
@@ -263,8 +403,9 @@ try:
 
         try: plot_placeholder.pyplot(fig, clear_figure=False)
         except Exception as redraw_err: logger.error(f"Error redrawing plot: {redraw_err}", exc_info=True)
+        if not first_render_logged: mark_phase("first_render"); log_startup_report(); first_render_logged = True
 
-        time.sleep(REFRESH_INTERVAL)
+        time.sleep(LIVE_REFRESH_INTERVAL if live_listener and position else REFRESH_INTERVAL)
 
 except KeyboardInterrupt: logger.info("App interrupted.")
 except Exception as main_loop_err: logger.critical(f"Main loop error: {main_loop_err}", exc_info=True); st.error(f"App Error: {main_loop_err}")